@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Hourly consumption backfill
+
+Fetch the hourly consumption of a range of days, one JSON file per day.
+Run it again with the same arguments to resume an interrupted backfill.
+
+    ./backfill.py 2021-12-01 2022-03-31 --output backfill --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from hydro_api.backfill import Backfill
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the hourly consumption of a range of days")
+    parser.add_argument('start_date', help="first day, YYYY-MM-DD")
+    parser.add_argument('end_date', help="last day, YYYY-MM-DD")
+    parser.add_argument('--output', help="output directory (default: backfill.output_dir from the config)")
+    parser.add_argument('--workers', type=int, help="concurrent requests (default: backfill.workers from the config)")
+    args = parser.parse_args()
+
+    backfill = Backfill(output_dir=args.output, workers=args.workers)
+    failed = asyncio.run(backfill.run(args.start_date, args.end_date))
+    if failed:
+        log.error("%s days could not be fetched: %s" % (len(failed), ", ".join(failed)))
+        sys.exit(1)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the hydro quebec portal
+
+Serves the login chain (security settings, authentication, authorize redirect, relations, contract and session
+pages) and the winter credit, hourly and daily consumption endpoints from the recorded responses of the
+fixtures directory. The winter credit events are moved so that the current winter of the fixtures is the
+current winter, and the consumption responses take the requested dates.
+
+Run it alone and call patchUrls('http://127.0.0.1:8765') in the client process to point the API classes to it:
+
+    $ python benchmarks/mock_server.py --port 8765 --latency 0.05
+"""
+import argparse
+import copy
+import datetime
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+log = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Days between the start of the current winter and today once the fixture events are moved
+WINTER_DAYS_ELAPSED = 45
+
+# Paths of the mocked endpoints, same as the hydro ones
+URL_PATHS = {
+    'hydro_api.auth.Hydro': {
+        'SECURITY_URL': '/config/security.json',
+        'AUTH_URL': '/hqam/json/realms/root/realms/clients/authenticate',
+        'AUTHORIZE_URL': '/hqam/oauth2/authorize',
+        'TOKEN_URL': '/hqam/oauth2/access_token',
+        'RELATION_URL': '/cl/prive/api/v1_0/relations',
+        'INFOBASE_URL': '/cl/prive/api/v3_0/partenaires/infoBase',
+        'SESSION_URL': '/portail/prive/maj-session/',
+        'CONTRACT_URL': '/cl/prive/api/v3_0/partenaires/calculerSommaireContractuel?indMAJNombres=true',
+        'PORTRAIT_URL': '/portail/fr/group/clientele/portrait-de-consommation/',
+    },
+    'hydro_api.services.Services': {
+        'WINTER_CREDIT_URL': '/cl/prive/api/v3_0/tarificationDynamique/creditPointeCritique',
+        'HOURLY_CONSUMPTION_URL': '/portail/fr/group/clientele/portrait-de-consommation/'
+                                  'resourceObtenirDonneesConsommationHoraires/',
+        'DAILY_CONSUMPTION_URL': '/portail/fr/group/clientele/portrait-de-consommation/'
+                                 'resourceObtenirDonneesQuotidiennesConsommation',
+    }
+}
+
+
+def _apiClass(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def patchUrls(base_url):
+    """Point the URL constants of the API classes (sync and asyncio clients) to a mock server
+
+    :param: base_url: ex: http://127.0.0.1:8765
+
+    :return: the previous URLs, to give to restoreUrls()
+
+    :rtype: dict
+    """
+    saved = {}
+    for path, names in URL_PATHS.items():
+        cls = _apiClass(path)
+        saved[path] = {name: getattr(cls, name) for name in names}
+        for name, url_path in names.items():
+            setattr(cls, name, base_url + url_path)
+    return saved
+
+
+def restoreUrls(saved):
+    """Restore the URLs returned by patchUrls()"""
+    for path, names in saved.items():
+        cls = _apiClass(path)
+        for name, url in names.items():
+            setattr(cls, name, url)
+
+
+class MockHydro:
+    """
+    Mock hydro portal running in a background thread
+
+    :param: latency: seconds waited before answering each request
+    :param: port: listening port, a free port is used if 0
+    :param: fixtures: directory of the recorded responses
+    """
+
+    def __init__(self, latency=0.0, port=0, fixtures=FIXTURES_DIR):
+        self.latency = latency
+        self.port = port
+        self.fixtures = {}
+        for name in ('security', 'auth', 'relations', 'contract', 'winter_credit', 'hourly', 'daily'):
+            with open(os.path.join(fixtures, name + '.json'), 'r') as f:
+                self.fixtures[name] = json.load(f)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+        self.saved_urls = None
+        self.winter_credit = json.dumps(self._winterCredit()).encode()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def start(self):
+        """Start serving
+
+        :return: base url of the server
+
+        :rtype: str
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        log.info('mock hydro listening on %s' % self.base_url)
+        return self.base_url
+
+    def stop(self):
+        self.restore()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def patch(self):
+        """Point the API classes to the mock server"""
+        saved = patchUrls(self.base_url)
+        if self.saved_urls is None:
+            self.saved_urls = saved
+
+    def restore(self):
+        """Point the API classes back to hydro"""
+        if self.saved_urls is not None:
+            restoreUrls(self.saved_urls)
+            self.saved_urls = None
+
+    def requestCount(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def resetCounts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def _winterCredit(self):
+        """Winter credit fixture with the first winter moved around today"""
+        data = copy.deepcopy(self.fixtures['winter_credit'])
+        seasons = data['periodesEffacementsHivers']
+        if not seasons:
+            return data
+        start = datetime.date.fromisoformat(seasons[0]['dateDebutPeriodeHiver'][:10])
+        shift = datetime.date.today() - datetime.timedelta(days=WINTER_DAYS_ELAPSED) - start
+
+        def move(value):
+            return (datetime.date.fromisoformat(value[:10]) + shift).isoformat() + value[10:]
+
+        for season in seasons:
+            season['dateDebutPeriodeHiver'] = move(season['dateDebutPeriodeHiver'])
+            season['dateFinPeriodeHiver'] = move(season['dateFinPeriodeHiver'])
+            for event in season.get('periodesEffacementHiver', []):
+                event['dateEffacement'] = move(event['dateEffacement'])
+        return data
+
+    def _hourly(self, date):
+        data = copy.deepcopy(self.fixtures['hourly'])
+        data['results']['dateJour'] = date
+        return data
+
+    def _daily(self, start_date, end_date):
+        data = copy.deepcopy(self.fixtures['daily'])
+        template = data['results'][0]
+        day = datetime.date.fromisoformat(start_date)
+        last = datetime.date.fromisoformat(end_date)
+        results = []
+        while day <= last:
+            entry = copy.deepcopy(template)
+            entry['courant']['dateJourConso'] = day.isoformat()
+            entry['compare']['dateJourConso'] = (day - datetime.timedelta(days=365)).isoformat()
+            results.append(entry)
+            day += datetime.timedelta(days=1)
+        data['results'] = results
+        return data
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body in one packet, keep-alive connections would wait for delayed ACKs otherwise
+            disable_nagle_algorithm = True
+            wbufsize = 64 * 1024
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, data, headers=None):
+                self._send(200, json.dumps(data).encode(), headers=headers)
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with mock.lock:
+                    mock.requests[url.path] += 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                path = url.path
+                if path == '/config/security.json':
+                    self._send(200, json.dumps(mock.fixtures['security']).replace('{base}', mock.base_url).encode())
+                elif path.endswith('/authenticate'):
+                    if body:
+                        self._json({'tokenId': 'AQIC5wM2LY4Sfcz-bench', 'successUrl': '/hqam/console',
+                                    'realm': '/clients'})
+                    else:
+                        self._json(mock.fixtures['auth'])
+                elif path == '/hqam/oauth2/authorize':
+                    location = '%s#access_token=bench-access-token&id_token=bench-id-token&state=%s' \
+                               '&token_type=Bearer&expires_in=3599' % (query.get('redirect_uri', ''),
+                                                                       query.get('state', ''))
+                    self._send(302, headers={'Location': location})
+                elif path.endswith('/relations'):
+                    if self.headers.get('Authorization') != 'Bearer bench-access-token':
+                        self._send(401)
+                    else:
+                        self._json(mock.fixtures['relations'])
+                elif path.endswith('/calculerSommaireContractuel'):
+                    self._json(mock.fixtures['contract'])
+                elif path.endswith('/creditPointeCritique'):
+                    if self.headers.get('If-None-Match') == '"winter-credit"':
+                        self._send(304)
+                    else:
+                        self._send(200, mock.winter_credit, headers={'ETag': '"winter-credit"'})
+                elif path.endswith('/resourceObtenirDonneesConsommationHoraires/'):
+                    self._json(mock._hourly(query['date']))
+                elif path.endswith('/resourceObtenirDonneesQuotidiennesConsommation'):
+                    self._json(mock._daily(query['dateDebut'], query['dateFin']))
+                else:
+                    # Callback, infoBase, session and portrait pages, only their cookies matter
+                    self._send(200, b'<html></html>', content_type='text/html')
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock hydro quebec portal")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds waited before each answer")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = MockHydro(latency=args.latency, port=args.port)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Benchmarks against the mock hydro portal
+
+No network access nor hydro account is needed, every request is answered by
+:class:`benchmarks.mock_server.MockHydro`. The benchmarks run in a temporary directory with their own
+config/config.yaml, the config of the repository is not used.
+
+    $ python benchmarks/run.py --latency 0.02 --iterations 20 --contracts 200 --json results.json
+
+* cold_login: full login chain of a new Services()
+* warm_refresh: winter credit data refresh on a logged in session (response cache disabled)
+* current_state: getCurrentState() with fresh data, no request
+* fleet_cold / fleet_warm: one Fleet poll of many contracts, with and without the logins
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import yaml  # noqa: E402
+
+from benchmarks.mock_server import MockHydro  # noqa: E402
+
+BENCH_CONFIG = {
+    'ssl': {'validate_ssl': False},
+    'credentials': {'user': 'bench', 'password': 'bench'},
+    'session': {'cache_file': ''},
+    # Every refresh must reach the mock server
+    'cache': {'winter_credit_ttl': 0},
+    'fleet': {'requests_per_second': 1000000, 'burst': 1000000},
+}
+
+
+def stats(name, durations, requests):
+    """Summary of a list of durations in seconds
+
+    :rtype: dict
+    """
+    durations = sorted(durations)
+    count = len(durations)
+    total = sum(durations)
+    return {
+        'name': name,
+        'iterations': count,
+        'mean_ms': total / count * 1000,
+        'p50_ms': durations[count // 2] * 1000,
+        'p95_ms': durations[min(count - 1, int(count * 0.95))] * 1000,
+        'per_second': count / total if total else 0,
+        'requests': requests / count,
+    }
+
+
+def coldLogin(mock, iterations):
+    from hydro_api.services import Services
+    durations = []
+    mock.resetCounts()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        Services().login()
+        durations.append(time.perf_counter() - start)
+    return stats('cold_login', durations, mock.requestCount())
+
+
+def warmRefresh(mock, iterations):
+    from winter_credit.winter_credit import WinterCredit
+    winter_credit = WinterCredit()
+    durations = []
+    mock.resetCounts()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        winter_credit._refreshSnapshot()
+        durations.append(time.perf_counter() - start)
+    return stats('warm_refresh', durations, mock.requestCount())
+
+
+def currentState(mock, iterations):
+    from winter_credit.winter_credit import WinterCredit
+    winter_credit = WinterCredit()
+    durations = []
+    mock.resetCounts()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        winter_credit.getCurrentState()
+        durations.append(time.perf_counter() - start)
+    return stats('current_state', durations, mock.requestCount())
+
+
+def fleetPoll(mock, contracts):
+    from hydro_api.fleet import Fleet
+
+    async def poll():
+        fleet = Fleet([{'user': 'bench%s' % index, 'password': 'bench'} for index in range(contracts)])
+        results = []
+        try:
+            for name in ('fleet_cold', 'fleet_warm'):
+                mock.resetCounts()
+                start = time.perf_counter()
+                polls = await fleet.poll(spread=False)
+                duration = time.perf_counter() - start
+                failed = len([result for result in polls if not result.success])
+                if failed:
+                    print('%s: %s polls failed' % (name, failed), file=sys.stderr)
+                result = stats(name, [duration], mock.requestCount() / contracts)
+                result['contracts'] = contracts
+                result['per_second'] = contracts / duration
+                results.append(result)
+        finally:
+            await fleet.close()
+        return results
+
+    return asyncio.run(poll())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks against a local mock hydro portal")
+    parser.add_argument('--latency', type=float, default=0.0, help="mock server latency in seconds")
+    parser.add_argument('--iterations', type=int, default=20, help="iterations of the login and refresh benchmarks")
+    parser.add_argument('--state-iterations', type=int, default=2000, help="getCurrentState() calls")
+    parser.add_argument('--contracts', type=int, default=100, help="contracts polled by the fleet benchmark")
+    parser.add_argument('--concurrency', type=int, default=20, help="fleet.max_concurrency")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    mock = MockHydro(latency=args.latency)
+    mock.start()
+    mock.patch()
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'config'))
+        config = dict(BENCH_CONFIG, fleet=dict(BENCH_CONFIG['fleet'], max_concurrency=args.concurrency))
+        with open(os.path.join(directory, 'config', 'config.yaml'), 'w') as f:
+            yaml.safe_dump(config, f)
+        os.chdir(directory)
+        try:
+            results.append(coldLogin(mock, args.iterations))
+            results.append(warmRefresh(mock, args.iterations))
+            results.append(currentState(mock, args.state_iterations))
+            results += fleetPoll(mock, args.contracts)
+        finally:
+            os.chdir(cwd)
+            mock.stop()
+
+    print('%-14s %10s %10s %10s %10s %12s %10s' % ('benchmark', 'iterations', 'mean ms', 'p50 ms', 'p95 ms',
+                                                   'per second', 'requests'))
+    for result in results:
+        print('%-14s %10d %10.2f %10.2f %10.2f %12.1f %10.1f' % (
+            result['name'], result['iterations'], result['mean_ms'], result['p50_ms'], result['p95_ms'],
+            result['per_second'], result['requests']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'latency': args.latency, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
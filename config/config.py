@@ -3,18 +3,86 @@
 This part of the code can probably be rewritten :)
 """
 
-import yaml
+import logging
+import os
+import threading
+
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.default.yaml')
+
+log = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    """The config file is invalid"""
+
 
 class Element:
     """Used to create nested objects"""
     def __init__(self):
         pass
 
+
+def _load(path):
+    # yaml is only needed the first time a config file is read
+    import yaml
+    with open(path, 'r') as f:
+        return yaml.load(f.read(), Loader=yaml.FullLoader)
+
+
+def _checkType(name, value, default):
+    """Raise ConfigError if a value does not have the type of its default value"""
+    if default is None or value is None:
+        return
+    if isinstance(default, bool) or isinstance(value, bool):
+        valid = isinstance(value, bool) and isinstance(default, bool)
+    elif isinstance(default, (int, float)):
+        valid = isinstance(value, (int, float))
+    elif isinstance(default, str):
+        # Passwords or users made of digits are read as numbers
+        valid = isinstance(value, (str, int, float))
+    else:
+        valid = isinstance(value, type(default))
+    if not valid:
+        raise ConfigError('%s must be a %s, got %r' % (name, type(default).__name__, value))
+
+
 class Config:
-    """returns a config object"""
+    """returns a config object
+
+    Values missing from the config file are taken from config.default.yaml so that new sections
+    do not break existing config files. Values are checked against the type of their default value,
+    a ConfigError is raised for an invalid value and unknown keys are reported in the log.
+
+    Use :func:`get_config` to share a single object instead of reading the file again.
+    """
     def __init__(self, config_file='config/config.yaml'):
-        with open(config_file, 'r') as f:
-            config = yaml.load(f.read(), Loader=yaml.FullLoader)
+        config = _load(DEFAULT_CONFIG_FILE)
+        user_config = _load(config_file) or {}
+        if not isinstance(user_config, dict):
+            raise ConfigError('%s must contain sections' % config_file)
+        for k, v in user_config.items():
+            if k not in config:
+                log.warning('unknown config section %s in %s' % (k, config_file))
+            elif isinstance(config[k], dict):
+                if not isinstance(v, dict):
+                    raise ConfigError('%s must be a section' % k)
+                for sk, sv in v.items():
+                    if sk not in config[k]:
+                        log.warning('unknown config key %s.%s in %s' % (k, sk, config_file))
+                    else:
+                        _checkType('%s.%s' % (k, sk), sv, config[k][sk])
+            else:
+                _checkType(k, v, config[k])
+        for k, v in user_config.items():
+            if isinstance(v, dict) and isinstance(config.get(k), dict):
+                for sk, sv in v.items():
+                    # Nested values (ex: http.timeouts) keep the defaults of the keys not set
+                    if isinstance(sv, dict) and isinstance(config[k].get(sk), dict):
+                        config[k][sk] = dict(config[k][sk], **sv)
+                    else:
+                        config[k][sk] = sv
+            else:
+                config[k] = v
         for k, v in config.items():
             if isinstance(v,dict):
                 setattr(self, k, Element())
@@ -22,3 +90,23 @@ class Config:
                     setattr(getattr(self,k), sk,sv)
             else:
                 setattr(self, k, v)
+
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+def get_config(config_file='config/config.yaml'):
+    """Return the config object shared by the whole process
+
+    The file is read and validated once, the same object is returned by the next calls.
+
+    :param: config_file: config file path
+
+    :rtype: Config
+    """
+    path = os.path.abspath(config_file)
+    with _configs_lock:
+        if path not in _configs:
+            _configs[path] = Config(config_file)
+        return _configs[path]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Parquet export of the consumption and winter credit events
+
+Append the hourly and daily consumption of a range of days and the ended winter credit events to
+Parquet datasets partitioned by contract and month. Run it periodically: only the data exported since
+the last run is fetched and written.
+
+    ./export.py 2021-12-01 2022-03-31 --output lake
+"""
+import argparse
+import logging
+
+from hydro_api.export import ParquetExport
+from winter_credit.winter_credit import WinterCredit
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the consumption and the events to Parquet files")
+    parser.add_argument('start_date', help="first day, YYYY-MM-DD")
+    parser.add_argument('end_date', help="last day, YYYY-MM-DD")
+    parser.add_argument('--output', help="datasets directory (default: export.directory from the config)")
+    parser.add_argument('--no-events', action='store_true', help="do not export the winter credit events")
+    args = parser.parse_args()
+
+    export = ParquetExport(directory=args.output)
+    winter_credit = WinterCredit()
+    paths = export.exportConsumption(winter_credit.api, args.start_date, args.end_date)
+    if not args.no_events:
+        paths += export.exportEvents(winter_credit)
+    log.info("%s files written to %s" % (len(paths), export.directory))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Local HTTP state gateway
+
+Serve the winter credit state of the fleet accounts (or of the config credentials) to many local clients
+with a single hydro session per contract, see :class:`winter_credit.gateway.StateGateway`.
+
+    ./gateway.py --host 0.0.0.0 --port 8080
+    curl http://127.0.0.1:8080/contracts
+    curl http://127.0.0.1:8080/0312345678/state
+    curl -N http://127.0.0.1:8080/0312345678/events
+"""
+import argparse
+import asyncio
+import logging
+
+from winter_credit.gateway import StateGateway
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the winter credit state over HTTP")
+    parser.add_argument('--host', help="listening address (default: gateway.host from the config)")
+    parser.add_argument('--port', type=int, help="listening port (default: gateway.port from the config)")
+    args = parser.parse_args()
+
+    gateway = StateGateway(host=args.host, port=args.port)
+    try:
+        asyncio.run(gateway.run())
+    except KeyboardInterrupt:
+        pass
@@ -4,8 +4,11 @@ This code is just meant as an example / how-to use the lib
 
 It's voluntarily very verbose :)
 """
+import asyncio
+import datetime
 import logging
 import json
+from hydro_api.async_services import AsyncServices
 from hydro_api.services import Services
 from winter_credit.winter_credit import WinterCredit
 from winter_credit.event import Event
@@ -28,6 +31,21 @@ def LowLevelExample():
     print(json.dumps(s.getDailyConsumption('2022-01-04', '2022-01-05'), indent=True))
 
 
+async def AsyncExample():
+    today = datetime.date.today()
+    week = [(today - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7, 0, -1)]
+    async with AsyncServices() as s:
+        # The winter credit summary and the hourly consumption of the last week are fetched together
+        winter_credit, *hourly = await asyncio.gather(
+            s.getWinterCredit(),
+            *[s.getHourlyConsumption(day) for day in week]
+        )
+    print("WINTER CREDIT SUMMARY")
+    print(json.dumps(winter_credit, indent=True))
+    print("\n\nLAST WEEK HOURLY CONSUMPTION")
+    print(json.dumps(dict(zip(week, hourly)), indent=True))
+
+
 def HighLevelExample():
     w = WinterCredit()
     next_event_object = w.getNextEvent()
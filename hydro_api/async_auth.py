@@ -0,0 +1,282 @@
+"""
+Asyncio authentication and initialization of Hydro API
+"""
+import asyncio
+import json
+import logging
+import random
+import ssl
+import string
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config.config import get_config
+from datetime import datetime
+from .auth import Hydro
+from .metrics import metrics
+from .transport import RETRY_STATUS, CircuitOpenError, TransportError, getBreaker
+
+log = logging.getLogger(__name__)
+
+
+class AsyncHydro:
+    """
+    Asyncio Hydro API
+
+    Same login flow as :class:`hydro_api.auth.Hydro` on top of an aiohttp session.
+    All the requests go through a single connector so there is one connection pool per hydro host
+    (connexion, cl-services.idp and cl-ec-spring) shared by every concurrent call.
+
+    The requests follow the policy of :class:`hydro_api.transport.Transport`: latency budget per endpoint,
+    retries of the GET requests and circuit breaker of the host, shared with the synchronous clients.
+
+    The aiohttp session needs a running event loop, it is created by :meth:`open`.
+
+    :param: user: hydro account, defaults to the config credentials
+    :param: password: hydro account password, defaults to the config credentials
+    :param: connector: aiohttp connector shared with other clients, a private one is created if None
+    :param: rate_limiter: object with an ``acquire(url)`` coroutine awaited before every request
+    """
+
+    def __init__(self, user=None, password=None, connector=None, rate_limiter=None, **kwargs):
+        """Initialize parameters from the config file"""
+        self.config = get_config()
+        self.user = user or self.config.credentials.user
+        self.password = password or self.config.credentials.password
+        self.connector = connector
+        self.rate_limiter = rate_limiter
+        self.session = None
+        self.login_data = {}
+        self.token_id = ""
+        self.oauth2_settings = {}
+        self.guid = str(uuid.uuid1())
+        self.callback_uri = ""
+        self.state = "".join(random.choice(string.digits + string.ascii_letters) for i in range(40))
+        self.nonce = self.state
+        self.access_token = ""
+        self.token_expiry = 0
+        self.account_id = ""
+        self.customer_id = ""
+        self.contract_id = ""
+
+    async def open(self):
+        """Create the aiohttp session and its connection pool"""
+        if self.session is None or self.session.closed:
+            if self.connector is None:
+                connector = aiohttp.TCPConnector(limit_per_host=self.config.http.connections_per_host)
+                self.session = aiohttp.ClientSession(connector=connector)
+            else:
+                # Each client keeps its own cookies but the connection pool belongs to the caller
+                self.session = aiohttp.ClientSession(connector=self.connector, connector_owner=False)
+
+    async def close(self):
+        """Close the aiohttp session"""
+        if self.session is not None:
+            await self.session.close()
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.config.http.max_backoff, self.config.http.backoff * 2 ** attempt))
+
+    async def _request(self, method, url, endpoint='login', retry=None, **kwargs):
+        """Perform a request and read its body
+
+        A TransportError is raised when the request fails, a 5xx response is returned once the retries
+        are exhausted, see :meth:`hydro_api.transport.Transport.request`.
+
+        :param: method: HTTP method
+        :param: url: request url
+        :param: endpoint: key of the http.timeouts config parameter, defaults to login
+        :param: retry: retry failed requests, defaults to True for GET requests only
+
+        :return: aiohttp response, its body is already loaded so it can be used after the connection is released
+        """
+        if 'ssl' not in kwargs:
+            kwargs['ssl'] = None if self.config.ssl.validate_ssl else False
+        http = self.config.http
+        if retry is None:
+            retry = method.upper() == 'GET'
+        split_url = urlsplit(url)
+        breaker = getBreaker(split_url.netloc, http.breaker_failures, http.breaker_reset)
+        if not breaker.allow():
+            metrics.increment('hydro_request_errors_total', endpoint=endpoint, reason='circuit_open')
+            raise CircuitOpenError('%s is unavailable, request not sent' % split_url.netloc)
+
+        with metrics.timer('hydro_request_duration_seconds', endpoint=endpoint,
+                           url=split_url.netloc + split_url.path):
+            deadline = time.time() + http.timeouts.get(endpoint, http.timeouts['default'])
+            attempts = http.retries + 1 if retry else 1
+            for attempt in range(attempts):
+                error = None
+                resource = None
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(url)
+                timeout = aiohttp.ClientTimeout(total=max(deadline - time.time(), 0.1))
+                try:
+                    async with self.session.request(method, url, timeout=timeout, **kwargs) as resource:
+                        await resource.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                except BaseException:
+                    # A half open breaker would wait forever for the result of its trial request
+                    breaker.recordFailure()
+                    raise
+                if error is None and resource.status not in RETRY_STATUS:
+                    breaker.recordSuccess()
+                    return resource
+
+                delay = self._backoff(attempt)
+                if attempt + 1 == attempts or time.time() + delay >= deadline:
+                    break
+                log.debug('%s %s failed (%s), retrying in %.2fs'
+                          % (method, url, error or resource.status, delay))
+                metrics.increment('hydro_request_retries_total', endpoint=endpoint)
+                await asyncio.sleep(delay)
+
+        breaker.recordFailure()
+        if isinstance(error, asyncio.TimeoutError):
+            reason = 'timeout'
+        elif error is not None:
+            reason = 'connection'
+        else:
+            reason = 'status'
+        metrics.increment('hydro_request_errors_total', endpoint=endpoint, reason=reason)
+        if error is not None:
+            raise TransportError('%s %s failed: %r' % (method, url, error)) from error
+        return resource
+
+    async def set_oauth_settings(self):
+        """Read OAUTH2 settings from hydro json"""
+        if self.config.ssl.validate_ssl:
+            # Certificate chain is added manually as there is an issue with this domain
+            ssl_context = ssl.create_default_context(cafile='config/hydro-chain.pem')
+        else:
+            ssl_context = False
+        try:
+            data = await self._request('GET', Hydro.SECURITY_URL, ssl=ssl_context)
+            return json.loads(await data.text())['oauth2'][0]
+        except:
+            return {}
+
+    async def login(self):
+        """Full login, see :meth:`hydro_api.auth.Hydro.login`"""
+        await self.open()
+        if not self.oauth2_settings:
+            self.oauth2_settings = await self.set_oauth_settings()
+            self.callback_uri = self.oauth2_settings.get('redirectUri', '')
+        try:
+            log.debug('authenticating')
+            if not await self._auth():
+                return False
+        except:
+            log.error('authentication failed')
+            return False
+        if not self.access_token:
+            try:
+                log.debug('getting token')
+                self.access_token = await self._get_token()
+            except:
+                log.error('token acquisition failed')
+                return False
+        if not self.customer_id or not self.account_id or not self.contract_id:
+            try:
+                log.debug('getting account info')
+                await self._get_account_info()
+            except:
+                log.debug('failed to get account info')
+                return False
+        return True
+
+    async def _auth(self):
+        """OAUTH2 authentication"""
+        headers = {
+            "Content-Type": "application/json",
+            "X-NoSession": "true",
+            "X-Password": "anonymous",
+            "X-Requested-With": "XMLHttpRequest",
+            "X-Username": "anonymous"
+        }
+        resource = await self._request('POST', Hydro.AUTH_URL, headers=headers)
+        self.login_data = json.loads(await resource.text())
+        if 'tokenId' not in self.login_data and 'callbacks' in self.login_data:
+            # Fill the callback template
+            self.login_data['callbacks'][0]['input'][0]['value'] = self.user
+            self.login_data['callbacks'][1]['input'][0]['value'] = self.password
+
+            res = await self._request('POST', Hydro.AUTH_URL, data=json.dumps(self.login_data), headers=headers)
+            json_res = json.loads(await res.text())
+            if 'tokenId' not in json_res:
+                log.error('invalid credentials')
+                return False
+            self.token_id = json_res['tokenId']
+            return True
+
+        elif 'tokenId' in self.login_data:
+            self.token_id = self.login_data['tokenId']
+            return True
+
+        log.error('Something failed in the auth process')
+        return False
+
+    async def _get_token(self):
+        """OAUTH2 access token retrieval. Needed for the IDP api"""
+        params = {
+            "response_type": "id_token token",
+            "client_id": self.oauth2_settings['clientId'],
+            "state": self.state,
+            "redirect_uri": self.oauth2_settings['redirectUri'],
+            "scope": self.oauth2_settings['scope'],
+            "nonce": self.nonce,
+            "locale": "en"
+        }
+        resource = await self._request('GET', Hydro.AUTHORIZE_URL, params=params, allow_redirects=False)
+        callback_url = resource.headers['Location']
+        await self._request('GET', callback_url)
+        raw_callback_params = callback_url.split('/callback#', 1)[-1].split("&")
+        callback_params = dict([p.split("=", 1) for p in raw_callback_params])
+        if 'expires_in' in callback_params:
+            self.token_expiry = time.time() + int(callback_params['expires_in'])
+        return callback_params.get('access_token', "")
+
+    def get_api_headers(self):
+        """Headers used by IDP api"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.access_token,
+            "NO_PARTENAIRE_DEMANDEUR": self.account_id,
+            "NO_PARTENAIRE_TITULAIRE": self.customer_id,
+            "DATE_DERNIERE_VISITE": datetime.now().strftime("%Y-%m-%dT%H:%M:%S.000+0000"),
+            "GUID_SESSION": self.guid
+        }
+
+    async def _get_account_info(self):
+        """Retrieve account id, customer id and contract id"""
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.access_token
+        }
+        resource = await self._request('GET', Hydro.RELATION_URL, headers=headers)
+        data = json.loads(await resource.text())
+        try:
+            self.account_id = data[0]['noPartenaireDemandeur']
+            self.customer_id = data[0]['noPartenaireTitulaire']
+        except:
+            return False
+        headers = self.get_api_headers()
+
+        await self._request('GET', Hydro.INFOBASE_URL, headers=headers)
+        await self._request('GET', Hydro.SESSION_URL, params={"mode": "web"}, headers=headers)
+
+        resource = await self._request('GET', Hydro.CONTRACT_URL, headers=headers)
+        data = json.loads(await resource.text())
+        if 'comptesContrats' in data:
+            try:
+                self.contract_id = data['comptesContrats'][0]['listeNoContrat'][0]
+            except:
+                log.error('contract not found')
+                return False
+
+        await self._request('GET', Hydro.PORTRAIT_URL, headers=headers)
+        return True
@@ -0,0 +1,118 @@
+"""
+Asyncio wrappers to API calls
+"""
+import asyncio
+import datetime
+import json
+import logging
+
+from .async_auth import AsyncHydro
+from .consumption import merge_daily, split_range
+from .services import Services
+from .transport import TransportError
+
+log = logging.getLogger(__name__)
+
+
+class AsyncServices:
+    """
+    Hydro Quebec API services, asyncio flavor
+
+    Same methods as :class:`hydro_api.services.Services` as coroutines, so independent calls can run
+    concurrently on the shared connection pool.
+
+    :example:
+
+        ::
+
+            async with AsyncServices() as s:
+                winter_credit, *week = await asyncio.gather(
+                    s.getWinterCredit(),
+                    *[s.getHourlyConsumption(day) for day in days]
+                )
+    """
+
+    def __init__(self, user=None, password=None, connector=None, rate_limiter=None):
+        self.auth = AsyncHydro(user=user, password=password, connector=connector, rate_limiter=rate_limiter)
+        self.config = self.auth.config
+        self.api_headers = {}
+
+    async def login(self):
+        """Open the session and login
+
+        :return: True if the login succeeded
+
+        :rtype: bool
+        """
+        logged_in = await self.auth.login()
+        self.api_headers = self.auth.get_api_headers()
+        return logged_in
+
+    async def close(self):
+        await self.auth.close()
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get(self, url, endpoint, **kwargs):
+        api_call_response = await self.auth._request('GET', url, endpoint=endpoint, **kwargs)
+        if api_call_response.status >= 500:
+            raise TransportError('%s returned %s' % (url, api_call_response.status))
+        return json.loads(await api_call_response.text())
+
+    async def getWinterCredit(self):
+        """Return information about the winter credit
+
+        :return: raw JSON from hydro QC API
+        """
+        params = {
+            'noContrat': self.auth.contract_id
+        }
+        return await self._get(Services.WINTER_CREDIT_URL, 'winter_credit', headers=self.api_headers,
+                               params=params)
+
+    async def getTodayHourlyConsumption(self):
+        """Return latest consumption info (about 2h delay it seems)
+
+        :return: raw JSON from hydro QC API for current day (not officially supported, data delayed)
+        """
+        date = datetime.date
+        today = date.today().strftime('%Y-%m-%d')
+        yesterday = (date.today() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        # We need to call a valid date first as theoretically today is invalid
+        # and the api will not respond if called directly
+        await self.getHourlyConsumption(yesterday)
+        return await self.getHourlyConsumption(today)
+
+    async def getHourlyConsumption(self, date):
+        """Return hourly consumption for a specific day
+
+        :param: date: YYYY-MM-DD string to pass to API
+
+        :return: raw JSON from hydro QC API
+        """
+        return await self._get(Services.HOURLY_CONSUMPTION_URL, 'hourly', params={'date': date})
+
+    async def getDailyConsumption(self, start_date, end_date):
+        """Return daily consumption for a range of days
+
+        :param: start_date: YYYY-MM-DD string to pass to API
+        :param: end_date: YYYY-MM-DD string to pass to API
+
+        Ranges longer than http.daily_window_days are fetched concurrently in windows and merged,
+        see :meth:`hydro_api.services.Services.getDailyConsumption`.
+
+        :return: raw JSON from hydro QC API
+        """
+        windows = split_range(start_date, end_date, self.config.http.daily_window_days)
+        responses = await asyncio.gather(*[
+            self._get(Services.DAILY_CONSUMPTION_URL, 'daily', params={'dateDebut': window[0], 'dateFin': window[1]})
+            for window in windows
+        ])
+        if len(responses) == 1:
+            return responses[0]
+        return merge_daily(responses, start_date, end_date)
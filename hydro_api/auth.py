@@ -4,16 +4,24 @@ Authentication and initialization of Hydro API
 import json
 import random
 import string
+import time
 import uuid
-import requests
 import logging
 
-from config.config import Config
+from config.config import get_config
 from datetime import datetime
+from .metrics import metrics
+from .session_cache import SessionCache
+from .transport import Transport
 
 
 log = logging.getLogger(__name__)
 
+
+class LoginError(Exception):
+    """The login failed or hydro rejected the session"""
+
+
 class Hydro:
     """
     Hydro API
@@ -21,6 +29,11 @@ class Hydro:
     Defines Hydro API URL and methods to login and initialize the API
     Hydro API is composed of several components that are using different method for authentication
     The initial login phase is achieved via oauth2 and the rest use session cookies to carry the authentication.
+
+    The session cache file (session.cache_file) is only used for the account of the config credentials.
+
+    :param: user: hydro account, defaults to the config credentials
+    :param: password: hydro account password, defaults to the config credentials
     """
 
     # OAUTH uri
@@ -37,21 +50,26 @@ class Hydro:
                    "calculerSommaireContractuel?indMAJNombres=true"
     PORTRAIT_URL = "https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/portrait-de-consommation/"
 
-    def __init__(self, **kwargs):
-        """Initialize parameters from the config file and hydro OAUTH2 settings URL"""
-        self.session = requests.Session()
-        self.config = Config()
-        if not self.config.ssl.validate_ssl:
-            from urllib3.exceptions import InsecureRequestWarning
-            requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+    def __init__(self, user=None, password=None, **kwargs):
+        """Initialize parameters from the config file, nothing is sent to hydro before login()"""
+        self.config = get_config()
+        self.user = user or self.config.credentials.user
+        self.password = password or self.config.credentials.password
+        self.session = Transport(self.config)
         self.login_data = {}
         self.token_id = ""
-        self.oauth2_settings = self.set_oauth_settings()
+        self.session_cache = None
+        self.cached_session = None
+        if self.config.session.cache_file and self.user == self.config.credentials.user:
+            self.session_cache = SessionCache(self.config.session.cache_file, self.config.session.max_age)
+            self.cached_session = self.session_cache.load()
+        self.oauth2_settings = self.cached_session['oauth2_settings'] if self.cached_session else {}
         self.guid = str(uuid.uuid1())
-        self.callback_uri = self.oauth2_settings['redirectUri']
+        self.callback_uri = self.oauth2_settings.get('redirectUri', '')
         self.state = "".join(random.choice(string.digits + string.ascii_letters) for i in range(40))
         self.nonce = self.state
         self.access_token = ""
+        self.token_expiry = 0
         self.account_id = ""
         self.customer_id = ""
         self.contract_id = ""
@@ -60,9 +78,9 @@ class Hydro:
         """Read OAUTH2 settings from hydro json"""
         if self.config.ssl.validate_ssl:
             # Certificate chain is added manually as there is an issue with this domain
-            data = self.session.get(self.SECURITY_URL, verify='config/hydro-chain.pem')
+            data = self.session.get(self.SECURITY_URL, verify='config/hydro-chain.pem', endpoint='login')
         else:
-            data = self.session.get(self.SECURITY_URL, verify=False)
+            data = self.session.get(self.SECURITY_URL, verify=False, endpoint='login')
         try:
             return data.json()['oauth2'][0]
         except:
@@ -76,29 +94,111 @@ class Hydro:
         1. authenticate
         2. get an access token
         3. get user information and hit the pages needed to initialize the session
+
+        When a session cache is configured, the cached session is tried first and the full login
+        is only performed if hydro rejects it.
         """
+        if not self.oauth2_settings and not self.cached_session:
+            with metrics.timer('hydro_login_stage_duration_seconds', stage='oauth_settings'):
+                self.oauth2_settings = self.set_oauth_settings()
+            self.callback_uri = self.oauth2_settings.get('redirectUri', '')
+        if self.cached_session:
+            cached_session = self.cached_session
+            self.cached_session = None
+            self._restore_session(cached_session)
+            with metrics.timer('hydro_login_stage_duration_seconds', stage='check_session'):
+                valid = self._check_session()
+            if valid:
+                log.debug('cached session is valid, skipping login')
+                # Keep the cookies refreshed by the check, the session still expires max_age after its login
+                self.session_cache.save(self, saved_at=cached_session['saved_at'])
+                metrics.increment('hydro_logins_total', result='cached')
+                return True
+            log.debug('cached session rejected, performing full login')
+            self._reset_session()
         try:
             log.debug('authenticating')
-            self._auth()
+            with metrics.timer('hydro_login_stage_duration_seconds', stage='auth'):
+                self._auth()
         except:
             log.error('authentication failed')
+            metrics.increment('hydro_logins_total', result='failure')
             return False
         if not self.access_token:
             try:
                 log.debug('getting token')
-                self.access_token = self._get_token()
+                with metrics.timer('hydro_login_stage_duration_seconds', stage='token'):
+                    self.access_token = self._get_token()
             except:
                 log.error('token acquisition failed')
+                metrics.increment('hydro_logins_total', result='failure')
                 return False
         if not self.customer_id or not self.account_id or not self.contract_id:
             try:
                 log.debug('getting account info')
-                self._get_account_info()
+                with metrics.timer('hydro_login_stage_duration_seconds', stage='account_info'):
+                    self._get_account_info()
             except:
                 log.debug('failed to get account info')
+                metrics.increment('hydro_logins_total', result='failure')
                 return False
+        if self.session_cache:
+            self.session_cache.save(self)
+        metrics.increment('hydro_logins_total', result='success')
         return True
 
+    def _restore_session(self, cached_session):
+        """Load cookies, tokens and account ids from a cached session"""
+        for cookie in cached_session['cookies']:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'],
+                                     path=cookie['path'], expires=cookie['expires'], secure=cookie['secure'])
+        self.access_token = cached_session['access_token']
+        self.token_expiry = cached_session['token_expiry']
+        self.guid = cached_session['guid']
+        self.account_id = cached_session['account_id']
+        self.customer_id = cached_session['customer_id']
+        self.contract_id = cached_session['contract_id']
+
+    def _reset_session(self):
+        """Drop the current session to start a login from scratch"""
+        self.session.cookies.clear()
+        self.session_cache.clear()
+        self.login_data = {}
+        self.token_id = ""
+        self.guid = str(uuid.uuid1())
+        self.access_token = ""
+        self.token_expiry = 0
+        self.account_id = ""
+        self.customer_id = ""
+        self.contract_id = ""
+
+    def _check_session(self):
+        """Check that the current session is still accepted by hydro
+
+        :return: True if the access token and the portal session are still valid
+
+        :rtype: bool
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + self.access_token
+        }
+        try:
+            resource = self.session.get(self.RELATION_URL, headers=headers,
+                                        verify=self.config.ssl.validate_ssl, endpoint='login')
+            if resource.status_code != 200:
+                return False
+            data = resource.json()
+            if data[0]['noPartenaireDemandeur'] != self.account_id:
+                return False
+            # Keep the portal session alive, data calls depend on it
+            resource = self.session.get(self.SESSION_URL, params={"mode": "web"}, headers=self.get_api_headers(),
+                                        verify=self.config.ssl.validate_ssl, endpoint='login')
+            return resource.status_code == 200
+        except:
+            log.debug('unable to validate cached session')
+            return False
+
     def _auth(self):
         """OAUTH2 authentication"""
         log.debug("performing authentication")
@@ -112,7 +212,7 @@ class Hydro:
 
         try:
             resource = self.session.post(self.AUTH_URL, headers=headers,
-                                         verify=self.config.ssl.validate_ssl)
+                                         verify=self.config.ssl.validate_ssl, endpoint='login')
         except Exception as e:
             log.error('shit happend')
         try:
@@ -123,14 +223,14 @@ class Hydro:
         if 'tokenId' not in self.login_data and 'callbacks' in self.login_data:
             log.debug("no token id but data has callback")
             # Fill the callback template
-            self.login_data['callbacks'][0]['input'][0]['value'] = self.config.credentials.user
-            self.login_data['callbacks'][1]['input'][0]['value'] = self.config.credentials.password
+            self.login_data['callbacks'][0]['input'][0]['value'] = self.user
+            self.login_data['callbacks'][1]['input'][0]['value'] = self.password
 
             json_data = json.dumps(self.login_data)
             try:
                 log.debug("trying to get a token")
                 res = self.session.post(self.AUTH_URL, data=json_data, headers=headers,
-                                        verify=self.config.ssl.validate_ssl)
+                                        verify=self.config.ssl.validate_ssl, endpoint='login')
             except:
                 log.error('Unable to connect.')
                 return False
@@ -168,11 +268,13 @@ class Hydro:
             "locale": "en"
         }
         resource = self.session.get(self.AUTHORIZE_URL, params=params, allow_redirects=False,
-                                    verify=self.config.ssl.validate_ssl)
+                                    verify=self.config.ssl.validate_ssl, endpoint='login')
         callback_url = resource.headers['Location']
-        self.session.get(callback_url, verify=self.config.ssl.validate_ssl)
+        self.session.get(callback_url, verify=self.config.ssl.validate_ssl, endpoint='login')
         raw_callback_params = callback_url.split('/callback#', 1)[-1].split("&")
         callback_params = dict([p.split("=", 1) for p in raw_callback_params])
+        if 'expires_in' in callback_params:
+            self.token_expiry = time.time() + int(callback_params['expires_in'])
         if 'access_token' in callback_params:
             return callback_params['access_token']
         else:
@@ -198,7 +300,7 @@ class Hydro:
         }
 
         resource = self.session.get(self.RELATION_URL, headers=headers,
-                                    verify=self.config.ssl.validate_ssl)
+                                    verify=self.config.ssl.validate_ssl, endpoint='login')
         data = resource.json()
         try:
             self.account_id = data[0]['noPartenaireDemandeur']
@@ -209,12 +311,12 @@ class Hydro:
         headers = self.get_api_headers()
 
         self.session.get(self.INFOBASE_URL, headers=headers,
-                         verify=self.config.ssl.validate_ssl)
+                         verify=self.config.ssl.validate_ssl, endpoint='login')
         self.session.get(self.SESSION_URL, params=params, headers=headers,
-                         verify=self.config.ssl.validate_ssl)
+                         verify=self.config.ssl.validate_ssl, endpoint='login')
 
         resource = self.session.get(self.CONTRACT_URL, headers=headers,
-                                    verify=self.config.ssl.validate_ssl)
+                                    verify=self.config.ssl.validate_ssl, endpoint='login')
         data = resource.json()
         if 'comptesContrats' in data:
             try:
@@ -223,7 +325,7 @@ class Hydro:
                 log.error('contract not found')
                 return False
 
-        self.session.get(self.PORTRAIT_URL, headers=headers, verify=self.config.ssl.validate_ssl)
+        self.session.get(self.PORTRAIT_URL, headers=headers, verify=self.config.ssl.validate_ssl, endpoint='login')
 
         return True
 
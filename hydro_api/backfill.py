@@ -0,0 +1,171 @@
+"""
+Resumable historical backfill of the hourly consumption
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+from config.config import get_config
+from .async_services import AsyncServices
+from .consumption import hourly_complete
+
+log = logging.getLogger(__name__)
+
+
+class Backfill:
+    """
+    Fetch the hourly consumption of a range of days
+
+    Days are fetched concurrently by a pool of workers and written to ``<output_dir>/<YYYY-MM-DD>.json``.
+    Completed days are recorded in a checkpoint file as they finish so an interrupted run
+    only fetches the missing days when it is started again. A day is completed once hydro has a value
+    for each of its hours or when it is older than ``backfill.final_after_days``, the other days are
+    written but fetched again by the next run.
+
+    :param: output_dir: directory receiving one JSON file per day, defaults to ``backfill.output_dir``
+    :param: workers: number of concurrent requests, defaults to ``backfill.workers``
+    """
+
+    CHECKPOINT_FILE = '.checkpoint.json'
+
+    def __init__(self, output_dir=None, workers=None):
+        self.config = get_config()
+        self.output_dir = output_dir or self.config.backfill.output_dir
+        self.workers = workers or self.config.backfill.workers
+        self.checkpoint_path = os.path.join(self.output_dir, self.CHECKPOINT_FILE)
+        self.completed = set()
+        self.failed = set()
+
+    def _loadCheckpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                self.completed = set(json.load(f)['completed'])
+        except FileNotFoundError:
+            self.completed = set()
+        except (OSError, ValueError, KeyError):
+            log.warning('invalid checkpoint %s, starting over' % self.checkpoint_path)
+            self.completed = set()
+
+    def _writeCheckpoint(self):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'completed': sorted(self.completed)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _writeDay(self, date, data):
+        tmp_path = os.path.join(self.output_dir, date + '.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(self.output_dir, date + '.json'))
+
+    async def _fetchDay(self, services, date):
+        """Fetch, write and checkpoint a single day
+
+        :return: True if the day is completed
+
+        :rtype: bool
+        """
+        try:
+            data = await services.getHourlyConsumption(date)
+        except Exception:
+            log.error('unable to fetch %s' % date)
+            self.failed.add(date)
+            return False
+        if not isinstance(data, dict) or not data.get('results'):
+            log.error('no data for %s' % date)
+            self.failed.add(date)
+            return False
+        self._writeDay(date, data)
+        self.failed.discard(date)
+        # Hydro publishes the hours with a delay (today is never complete), a recent day missing some is
+        # fetched again by the next run
+        final_date = datetime.date.today() - datetime.timedelta(days=self.config.backfill.final_after_days)
+        if hourly_complete(data) or date <= final_date.isoformat():
+            self.completed.add(date)
+            self._writeCheckpoint()
+            log.debug('%s completed' % date)
+        else:
+            log.debug('%s is not complete yet' % date)
+        return True
+
+    async def _worker(self, services, queue):
+        while True:
+            date = await queue.get()
+            try:
+                await self._fetchDay(services, date)
+            finally:
+                queue.task_done()
+
+    def pendingDays(self, start_date, end_date):
+        """Return the days of the range that are not completed yet
+
+        Days after today are ignored as hydro has no data for them.
+
+        :param: start_date: YYYY-MM-DD string
+        :param: end_date: YYYY-MM-DD string
+
+        :rtype: list
+        """
+        day = datetime.date.fromisoformat(start_date)
+        last = min(datetime.date.fromisoformat(end_date), datetime.date.today())
+        days = []
+        while day <= last:
+            if day.isoformat() not in self.completed:
+                days.append(day.isoformat())
+            day += datetime.timedelta(days=1)
+        return days
+
+    async def run(self, start_date, end_date, services=None):
+        """Fetch every missing day of the range
+
+        :param: start_date: YYYY-MM-DD string
+        :param: end_date: YYYY-MM-DD string
+        :param: services: logged in AsyncServices, a new one is created and closed when None
+
+        :return: days that could not be fetched
+
+        :rtype: list
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._loadCheckpoint()
+        self.failed = set()
+        days = self.pendingDays(start_date, end_date)
+        if not days:
+            return []
+
+        own_services = services is None
+        if own_services:
+            services = AsyncServices()
+            if not await services.login():
+                await services.close()
+                raise RuntimeError('login failed')
+        try:
+            today = datetime.date.today().isoformat()
+            # The API will not answer for today unless a valid date was requested first, so today
+            # is fetched last and the first request is done alone to prime the session.
+            fetch_today = today in days
+            if fetch_today:
+                days.remove(today)
+            if days:
+                await self._fetchDay(services, days.pop(0))
+            else:
+                yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+                await services.getHourlyConsumption(yesterday)
+
+            queue = asyncio.Queue()
+            for day in days:
+                queue.put_nowait(day)
+            workers = [asyncio.ensure_future(self._worker(services, queue)) for i in range(self.workers)]
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+            if fetch_today:
+                await self._fetchDay(services, today)
+        finally:
+            if own_services:
+                await services.close()
+        return sorted(self.failed)
@@ -0,0 +1,136 @@
+"""
+Response cache for the hydro API calls
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """
+    Bounded LRU cache kept in memory
+
+    Entries are dicts with the following keys:
+
+        * data: decoded JSON response
+        * expires: unix timestamp after which the entry must be revalidated, None if it never expires
+        * etag / last_modified: validators sent back to hydro when the entry is stale
+
+    :param: max_entries: the least recently used entries are evicted above this size
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class DiskCache:
+    """
+    Cache stored as one JSON file per entry in a directory
+
+    Several processes can share the same directory, files are replaced atomically.
+    The oldest files are removed above max_entries.
+
+    :param: directory: cache directory, created if needed
+    :param: max_entries: maximum number of files kept
+    """
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, entry):
+        path = self._path(key)
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            log.error('unable to write cache entry %s' % path)
+            return
+        self._evict()
+
+    def _evict(self):
+        try:
+            files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                     if name.endswith('.json')]
+            if len(files) <= self.max_entries:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_entries]:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class ResponseCache:
+    """
+    Two levels response cache: a memory LRU in front of an optional shared disk cache
+
+    Any object with the same get(key) / set(key, entry) methods can be given to
+    :class:`hydro_api.services.Services` instead.
+
+    :param: max_entries: size of the memory LRU (and of the disk cache)
+    :param: directory: shared disk cache directory, memory only if empty
+    """
+
+    def __init__(self, max_entries, directory=None):
+        self.memory = MemoryCache(max_entries)
+        self.disk = DiskCache(directory, max_entries) if directory else None
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Build the cache described by the cache section of the config, None if disabled"""
+        if not config.cache.enabled:
+            return None
+        return cls(config.cache.max_entries, config.cache.directory)
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        stale = entry is None or (entry['expires'] is not None and entry['expires'] <= time.time())
+        if stale and self.disk is not None:
+            # Another process may have fetched a fresher response
+            disk_entry = self.disk.get(key)
+            if disk_entry is not None and (entry is None or disk_entry['expires'] is None
+                                           or disk_entry['expires'] > entry['expires']):
+                entry = disk_entry
+                self.memory.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
@@ -0,0 +1,285 @@
+"""
+Normalization of the consumption data returned by hydro
+
+Hydro returns French keyed JSON documents. The helpers below turn them into flat records:
+
+    ::
+
+        {'timestamp': 1641794400.0, 'date': '2022-01-10', 'kwh': 1.23, 'temperature': -12.0}
+
+``timestamp`` is the unix epoch of the start of the hour (hourly) or of the day (daily) in local time.
+``temperature`` is None when hydro does not provide it.
+
+The ``iter_`` functions parse a response while it is downloaded, from an iterable of byte chunks such as
+``response.iter_content()``, and yield the records one by one without building the whole document.
+"""
+import codecs
+import datetime
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[\s,]*')
+# Marks an array element that needs more data, None is the value of null
+_INCOMPLETE = object()
+
+
+def _timestamp(date, time='00:00:00'):
+    return datetime.datetime.strptime(date + ' ' + time, '%Y-%m-%d %H:%M:%S').timestamp()
+
+
+def hourly_record(date, entry):
+    """Normalize one entry of listeDonneesConsoEnergieHoraire
+
+    :param: date: YYYY-MM-DD day of the entry
+    :param: entry: raw hourly entry
+
+    :rtype: dict
+    """
+    return {
+        'timestamp': _timestamp(date, entry['heure']),
+        'date': date,
+        'kwh': entry.get('consoTotal'),
+        # Hourly temperatures are not part of this resource
+        'temperature': None
+    }
+
+
+def daily_record(entry):
+    """Normalize one entry of the daily consumption results
+
+    :param: entry: raw daily entry, the 'courant' part is used
+
+    :rtype: dict
+    """
+    current = entry.get('courant', entry)
+    return {
+        'timestamp': _timestamp(current['dateJourConso']),
+        'date': current['dateJourConso'],
+        'kwh': current.get('consoTotalQuot'),
+        'temperature': current.get('tempMoyenneQuot')
+    }
+
+
+def hours_of_day(date):
+    """Number of hours of a local day, 23 or 25 on daylight saving time changes
+
+    :param: date: YYYY-MM-DD string
+
+    :rtype: int
+    """
+    next_day = (datetime.date.fromisoformat(date) + datetime.timedelta(days=1)).isoformat()
+    return round((_timestamp(next_day) - _timestamp(date)) / 3600)
+
+
+def hourly_complete(data):
+    """Return True if a getHourlyConsumption response has a value for every hour of its day
+
+    :param: data: raw JSON from Services.getHourlyConsumption
+
+    :rtype: bool
+    """
+    try:
+        date = data['results']['dateJour'][:10]
+        entries = data['results']['listeDonneesConsoEnergieHoraire']
+    except (KeyError, TypeError):
+        return False
+    values = len([entry for entry in entries or [] if entry.get('consoTotal') is not None])
+    # The repeated hour of the fall back day may be reported as a single hour
+    return values >= min(hours_of_day(date), 24)
+
+
+def daily_complete(data, start_date, end_date):
+    """Return True if a getDailyConsumption response has a value for every day of its range
+
+    :param: data: raw JSON from Services.getDailyConsumption
+    :param: start_date: YYYY-MM-DD string
+    :param: end_date: YYYY-MM-DD string
+
+    :rtype: bool
+    """
+    dates = {record['date'] for record in daily_records(data) if record['kwh'] is not None}
+    day = datetime.date.fromisoformat(start_date)
+    last = datetime.date.fromisoformat(end_date)
+    while day <= last:
+        if day.isoformat() not in dates:
+            return False
+        day += datetime.timedelta(days=1)
+    return True
+
+
+def hourly_valid(data):
+    """Return True if a response has the getHourlyConsumption format
+
+    :rtype: bool
+    """
+    try:
+        return isinstance(data['results']['listeDonneesConsoEnergieHoraire'], list)
+    except (KeyError, TypeError):
+        return False
+
+
+def daily_valid(data):
+    """Return True if a response has the getDailyConsumption format
+
+    :rtype: bool
+    """
+    try:
+        return isinstance(data['results'], list)
+    except (KeyError, TypeError):
+        return False
+
+
+def hourly_records(data):
+    """Return the normalized records of a getHourlyConsumption response
+
+    :param: data: raw JSON from Services.getHourlyConsumption
+
+    :rtype: list
+    """
+    try:
+        results = data['results']
+        date = results['dateJour'][:10]
+        entries = results['listeDonneesConsoEnergieHoraire']
+    except (KeyError, TypeError):
+        return []
+    return [hourly_record(date, entry) for entry in entries]
+
+
+def daily_records(data):
+    """Return the normalized records of a getDailyConsumption response
+
+    :param: data: raw JSON from Services.getDailyConsumption
+
+    :rtype: list
+    """
+    try:
+        entries = data['results']
+    except (KeyError, TypeError):
+        return []
+    return [daily_record(entry) for entry in entries or []]
+
+
+def split_range(start_date, end_date, days):
+    """Split a range of days into consecutive windows of at most days days
+
+    :param: start_date: YYYY-MM-DD string
+    :param: end_date: YYYY-MM-DD string, included
+    :param: days: maximum window length
+
+    :return: list of (start_date, end_date) YYYY-MM-DD tuples, in chronological order
+
+    :rtype: list
+    """
+    start = datetime.date.fromisoformat(start_date)
+    end = datetime.date.fromisoformat(end_date)
+    windows = []
+    while start <= end:
+        window_end = min(start + datetime.timedelta(days=days - 1), end)
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end + datetime.timedelta(days=1)
+    return windows or [(start_date, end_date)]
+
+
+def merge_daily(responses, start_date, end_date):
+    """Merge the getDailyConsumption responses of several windows into one response
+
+    The entries are ordered by date, an entry returned by several windows is kept once and entries
+    outside of the range are dropped. The other keys are taken from the first response.
+
+    :param: responses: raw JSON responses, in chronological order
+    :param: start_date: YYYY-MM-DD string
+    :param: end_date: YYYY-MM-DD string
+
+    :return: raw JSON in the getDailyConsumption format
+
+    :rtype: dict
+    """
+    entries = {}
+    for response in responses:
+        try:
+            results = response['results'] or []
+        except (KeyError, TypeError):
+            continue
+        for entry in results:
+            date = entry.get('courant', entry).get('dateJourConso')
+            if date is not None and start_date <= date[:10] <= end_date:
+                entries.setdefault(date[:10], entry)
+    merged = dict(responses[0]) if responses and isinstance(responses[0], dict) else {}
+    merged['results'] = [entries[date] for date in sorted(entries)]
+    return merged
+
+
+def iter_json_array(chunks, key):
+    """Yield the elements of the first array named key of a JSON document, while it is received
+
+    Only the element being parsed is kept in memory. The document is expected to be well formed, the
+    elements found before an invalid part are yielded before the ValueError is raised.
+
+    :param: chunks: iterable of bytes (UTF-8) or str
+    :param: key: name of the array, ex: 'results'
+
+    :return: generator of the decoded elements
+    """
+    chunks = iter(chunks)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    start = re.compile(r'"%s"\s*:\s*(\[|null)' % re.escape(key))
+    buffer = ''
+    done = False
+
+    def read():
+        nonlocal done
+        for chunk in chunks:
+            text = decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                return text
+        done = True
+        return decoder.decode(b'', final=True)
+
+    # Find the start of the array, the part of the document before it is dropped
+    while True:
+        match = start.search(buffer)
+        if match is not None:
+            break
+        if done:
+            return
+        # Keep enough characters for a key split between two chunks
+        buffer = buffer[-(len(key) + 64):] + read()
+    if match.group(1) == 'null':
+        return
+    buffer = buffer[match.end():]
+    pos = 0
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        element = _INCOMPLETE
+        if pos < len(buffer):
+            try:
+                element, end = _decoder.raw_decode(buffer, pos)
+                # A number at the end of the buffer may continue in the next chunk, ex: 1 then .5 or e3
+                if not done and (end == len(buffer) or buffer[end] in '.eE'):
+                    element = _INCOMPLETE
+            except ValueError:
+                if done:
+                    raise
+        if element is _INCOMPLETE:
+            if done:
+                raise ValueError('%s array is not terminated' % key)
+            buffer = buffer[pos:] + read()
+            pos = 0
+            continue
+        pos = end
+        yield element
+
+
+def iter_daily_records(chunks):
+    """Yield the normalized records of a daily consumption response while it is received
+
+    :param: chunks: iterable of the response bytes, see :func:`iter_json_array`
+
+    :return: generator of records, see :func:`daily_record`
+    """
+    for entry in iter_json_array(chunks, 'results'):
+        yield daily_record(entry)
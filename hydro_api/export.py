@@ -0,0 +1,284 @@
+"""
+Columnar export of the consumption and winter credit events history
+"""
+import datetime
+import json
+import logging
+import os
+import time
+
+from config.config import get_config
+from .consumption import hourly_complete
+from .series import ConsumptionSeries
+
+log = logging.getLogger(__name__)
+
+
+def _pyarrow():
+    """Import pyarrow, only needed by the export"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('pyarrow is required to export Parquet files: pip install pyarrow') from e
+    return pyarrow
+
+
+def _monthStart(timestamp):
+    day = datetime.datetime.fromtimestamp(timestamp)
+    return datetime.datetime(day.year, day.month, 1)
+
+
+def _nextMonth(month):
+    return datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+class ParquetExport:
+    """
+    Export the consumption and the winter credit events to Parquet files
+
+    Each dataset is a directory of files partitioned by contract and month (local time), readable by
+    any Arrow / Parquet engine as a hive partitioned dataset:
+
+        ::
+
+            {directory}/hourly/contract=0312345678/month=2022-01/part-1643673600000-4242.parquet
+            {directory}/daily/...
+            {directory}/events/...
+
+    Exports are incremental: every export writes new part files and never rewrites the existing ones.
+    The last exported timestamp of each contract is kept in {directory}/{dataset}/_watermarks.json,
+    only the later rows are written by the next export. Consumption days more recent than
+    export.final_after_days and events not ended yet can still change, they are left for a later export.
+
+    pyarrow is only imported when files are written.
+
+    :param: directory: root directory of the datasets, defaults to export.directory
+
+    :example:
+
+        ::
+
+            export = ParquetExport('lake')
+            export.exportConsumption(Services(), '2021-12-01', '2022-03-31')
+            export.exportEvents(WinterCredit())
+    """
+
+    HOURLY = 'hourly'
+    DAILY = 'daily'
+    EVENTS = 'events'
+
+    def __init__(self, directory=None):
+        self.config = get_config()
+        self.directory = directory or self.config.export.directory
+
+    def _datasetDir(self, dataset):
+        return os.path.join(self.directory, dataset)
+
+    def _watermarksFile(self, dataset):
+        return os.path.join(self._datasetDir(dataset), '_watermarks.json')
+
+    def _loadWatermarks(self, dataset):
+        try:
+            with open(self._watermarksFile(dataset), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _saveWatermark(self, dataset, contract_id, timestamp):
+        watermarks = self._loadWatermarks(dataset)
+        watermarks[str(contract_id)] = timestamp
+        path = self._watermarksFile(dataset)
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(watermarks, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def watermark(self, dataset, contract_id):
+        """Return the last exported timestamp of a contract
+
+        :param: dataset: ParquetExport.HOURLY, DAILY or EVENTS
+        :param: contract_id: hydro contract id
+
+        :return: unix timestamp, None if nothing was exported yet
+        """
+        return self._loadWatermarks(dataset).get(str(contract_id))
+
+    def _finalLimit(self):
+        """Start of the first day that is not final yet"""
+        day = datetime.date.today() - datetime.timedelta(days=self.config.export.final_after_days - 1)
+        return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+    def _writePart(self, dataset, contract_id, month, table):
+        """Write a new part file in a contract / month partition
+
+        :return: path of the file
+        """
+        pa = _pyarrow()
+        partition = os.path.join(self._datasetDir(dataset), 'contract=%s' % contract_id,
+                                 'month=%s' % month.strftime('%Y-%m'))
+        os.makedirs(partition, exist_ok=True)
+        name = 'part-%d-%s.parquet' % (time.time() * 1000, os.getpid())
+        # Dataset readers skip the files starting with a dot, the file appears once complete
+        tmp_path = os.path.join(partition, '.' + name)
+        pa.parquet.write_table(table, tmp_path)
+        path = os.path.join(partition, name)
+        os.replace(tmp_path, path)
+        log.debug('%s rows written to %s' % (table.num_rows, path))
+        return path
+
+    def writeConsumption(self, dataset, contract_id, series):
+        """Append the final rows of a consumption series that were not exported yet
+
+        :param: dataset: ParquetExport.HOURLY or ParquetExport.DAILY
+        :param: contract_id: hydro contract id
+        :param: series: ConsumptionSeries or records, see :mod:`hydro_api.consumption`
+
+        :return: paths of the written files
+
+        :rtype: list
+        """
+        pa = _pyarrow()
+        if not isinstance(series, ConsumptionSeries):
+            series = ConsumptionSeries.fromRecords(series)
+        watermark = self.watermark(dataset, contract_id)
+        series = series.between(float('-inf') if watermark is None else watermark + 1, self._finalLimit())
+        if not len(series):
+            return []
+
+        paths = []
+        month = _monthStart(series.timestamps[0])
+        last_ts = series.timestamps[len(series) - 1]
+        while month.timestamp() <= last_ts:
+            next_month = _nextMonth(month)
+            rows = series.between(month.timestamp(), next_month.timestamp())
+            if len(rows):
+                columns = rows.to_numpy()
+                table = pa.table({
+                    'timestamp': pa.array(columns['timestamps'].astype('int64'), type=pa.timestamp('s', tz='UTC')),
+                    'kwh': pa.array(columns['kwh'], from_pandas=True),
+                    'temperature': pa.array(columns['temperatures'], from_pandas=True),
+                })
+                paths.append(self._writePart(dataset, contract_id, month, table))
+            month = next_month
+        self._saveWatermark(dataset, contract_id, last_ts)
+        log.info('%s %s rows exported for %s' % (len(series), dataset, contract_id))
+        return paths
+
+    def writeEvents(self, contract_id, events):
+        """Append the ended events that were not exported yet
+
+        :param: contract_id: hydro contract id
+        :param: events: Event objects, see :class:`winter_credit.event.Event`
+
+        :return: paths of the written files
+
+        :rtype: list
+        """
+        pa = _pyarrow()
+        watermark = self.watermark(self.EVENTS, contract_id)
+        now = time.time()
+        events = sorted((event for event in events
+                         if event.end_ts <= now and (watermark is None or event.start_ts > watermark)),
+                        key=lambda event: event.start_ts)
+        if not events:
+            return []
+
+        timestamp = pa.timestamp('s', tz='UTC')
+        paths = []
+        months = {}
+        for event in events:
+            months.setdefault(_monthStart(event.start_ts), []).append(event)
+        for month, month_events in sorted(months.items()):
+            table = pa.table({
+                'date': pa.array([datetime.date.fromordinal(event.day) for event in month_events], type=pa.date32()),
+                'start': pa.array([event.start_ts for event in month_events], type=timestamp),
+                'end': pa.array([event.end_ts for event in month_events], type=timestamp),
+                'pre_heat_start': pa.array([event.pre_heat_start_ts for event in month_events], type=timestamp),
+                'pre_heat_end': pa.array([event.pre_heat_end_ts for event in month_events], type=timestamp),
+            })
+            paths.append(self._writePart(self.EVENTS, contract_id, month, table))
+        self._saveWatermark(self.EVENTS, contract_id, events[-1].start_ts)
+        log.info('%s events exported for %s' % (len(events), contract_id))
+        return paths
+
+    def _pendingDays(self, dataset, contract_id, start_date, end_date):
+        """Days of the range after the watermark and old enough to be final"""
+        start = datetime.date.fromisoformat(start_date)
+        watermark = self.watermark(dataset, contract_id)
+        if watermark is not None:
+            start = max(start, datetime.datetime.fromtimestamp(watermark).date() + datetime.timedelta(days=1))
+        end = min(datetime.date.fromisoformat(end_date),
+                  datetime.date.today() - datetime.timedelta(days=self.config.export.final_after_days))
+        days = []
+        while start <= end:
+            days.append(start.isoformat())
+            start += datetime.timedelta(days=1)
+        return days
+
+    def exportConsumption(self, services, start_date, end_date):
+        """Fetch and export the hourly and daily consumption of a range of days
+
+        Only the days after the watermarks are requested from hydro. The export of a dataset stops before
+        the first day hydro does not answer completely, the watermark stays before that day and the next
+        export requests it again.
+
+        :param: services: Services object
+        :param: start_date: YYYY-MM-DD string
+        :param: end_date: YYYY-MM-DD string
+
+        :return: paths of the written files
+
+        :rtype: list
+        """
+        contract_id = services.contract_id
+        paths = []
+        days = self._pendingDays(self.HOURLY, contract_id, start_date, end_date)
+        if days:
+            series = ConsumptionSeries.fromHourly(self._completeHourly(services, days))
+            paths += self.writeConsumption(self.HOURLY, contract_id, series)
+        days = self._pendingDays(self.DAILY, contract_id, start_date, end_date)
+        if days:
+            series = ConsumptionSeries.fromRecords(self._completeDaily(services, days))
+            paths += self.writeConsumption(self.DAILY, contract_id, series)
+        return paths
+
+    def _completeHourly(self, services, days):
+        """Yield the hourly responses of the days until the first incomplete one"""
+        for day in days:
+            try:
+                data = services.getHourlyConsumption(day)
+            except Exception as e:
+                log.warning('hourly consumption of %s unavailable (%s), export stopped before it' % (day, e))
+                return
+            if not hourly_complete(data):
+                log.warning('hourly consumption of %s is incomplete, export stopped before it' % day)
+                return
+            yield data
+
+    def _completeDaily(self, services, days):
+        """Yield the daily records of the days until the first missing one"""
+        records = {}
+        try:
+            for record in services.iterDailyConsumption(days[0], days[-1]):
+                if record['kwh'] is not None:
+                    records[record['date']] = record
+        except Exception as e:
+            log.warning('daily consumption unavailable (%s), exporting the days received' % e)
+        for day in days:
+            if day not in records:
+                log.warning('daily consumption of %s is missing, export stopped before it' % day)
+                return
+            yield records[day]
+
+    def exportEvents(self, winter_credit):
+        """Export the events of the current and past winters
+
+        :param: winter_credit: WinterCredit object
+
+        :return: paths of the written files
+
+        :rtype: list
+        """
+        events = winter_credit.getAllEvents() + winter_credit.getPastWintersEvents()
+        return self.writeEvents(winter_credit.contract_id, events)
@@ -0,0 +1,176 @@
+"""
+Polling of many hydro accounts
+"""
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config.config import get_config
+from .async_services import AsyncServices
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket rate limiter
+
+    :param: rate: tokens added per second
+    :param: burst: maximum number of tokens in the bucket
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """One token bucket per hydro host"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    async def acquire(self, url):
+        """Wait for the bucket of the url host"""
+        host = urlsplit(url).hostname
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        await self.buckets[host].acquire()
+
+
+class PollResult:
+    """This class describe the outcome of an account poll"""
+
+    def __init__(self, user, success, latency, data=None, error=None):
+        self.user = user
+        self.success = success
+        self.latency = latency
+        self.data = data
+        self.error = error
+
+    def to_dict(self):
+        return {
+            'user': self.user,
+            'success': self.success,
+            'latency': self.latency,
+            'error': self.error
+        }
+
+
+class Fleet:
+    """
+    Winter credit poller for many accounts
+
+    Every account keeps its own logged in :class:`hydro_api.async_services.AsyncServices` between polls,
+    all of them sharing one connection pool and one token bucket per hydro host.
+    Polls are spread over the ``periods.event_refresh_seconds`` window and at most
+    ``fleet.max_concurrency`` accounts are polled at the same time.
+
+    :param: accounts: list of {'user': ..., 'password': ...}, defaults to ``fleet.accounts`` from the config
+
+    :example:
+
+        ::
+
+            fleet = Fleet()
+            results = asyncio.run(fleet.poll())
+    """
+
+    def __init__(self, accounts=None):
+        self.config = get_config()
+        if accounts is None:
+            accounts = self.config.fleet.accounts or [{
+                'user': self.config.credentials.user,
+                'password': self.config.credentials.password
+            }]
+        self.accounts = accounts
+        self.window = self.config.periods.event_refresh_seconds
+        self.rate_limiter = RateLimiter(self.config.fleet.requests_per_second, self.config.fleet.burst)
+        self.connector = None
+        self.clients = {}
+
+    async def _getClient(self, account):
+        """Return a logged in client for the account, login is only done on the first poll or after a failure"""
+        if self.connector is None:
+            self.connector = aiohttp.TCPConnector(limit_per_host=self.config.http.connections_per_host)
+        client = self.clients.get(account['user'])
+        if client is None:
+            client = AsyncServices(user=account['user'], password=account['password'],
+                                   connector=self.connector, rate_limiter=self.rate_limiter)
+            if not await client.login():
+                await client.close()
+                raise RuntimeError('login failed')
+            self.clients[account['user']] = client
+        return client
+
+    async def _pollAccount(self, account, delay, semaphore):
+        await asyncio.sleep(delay)
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                client = await self._getClient(account)
+                data = await client.getWinterCredit()
+            except Exception as e:
+                log.error('poll failed for %s' % account['user'])
+                client = self.clients.pop(account['user'], None)
+                if client is not None:
+                    await client.close()
+                return PollResult(account['user'], False, time.monotonic() - start, error=str(e))
+            return PollResult(account['user'], True, time.monotonic() - start, data=data)
+
+    async def poll(self, spread=True):
+        """Poll every account once
+
+        :param: spread: spread the polls evenly over the refresh window instead of starting them all at once
+
+        :return: one PollResult per account, in the accounts order
+
+        :rtype: list
+        """
+        semaphore = asyncio.Semaphore(self.config.fleet.max_concurrency)
+        step = self.window / len(self.accounts) if spread and self.accounts else 0
+        return await asyncio.gather(*[
+            self._pollAccount(account, index * step, semaphore)
+            for index, account in enumerate(self.accounts)
+        ])
+
+    async def run(self, callback):
+        """Poll the accounts forever, one pass per refresh window
+
+        :param: callback: called with the list of PollResult after each pass
+        """
+        while True:
+            start = time.monotonic()
+            results = await self.poll()
+            callback(results)
+            await asyncio.sleep(max(0, self.window - (time.monotonic() - start)))
+
+    async def close(self):
+        """Close every client and the shared connection pool"""
+        for client in self.clients.values():
+            await client.close()
+        self.clients = {}
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
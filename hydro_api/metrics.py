@@ -0,0 +1,210 @@
+"""
+Metrics of the hydro API calls, the login and the winter credit state evaluation
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from a cache hit to a stuck portal request
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+
+class Histogram:
+    """Cumulative histogram of observed values
+
+    :param: buckets: sorted upper bounds
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    Registry of counters and histograms
+
+    Every value is identified by a metric name and labels given as keyword arguments. Callbacks added with
+    addCallback() are called with (kind, name, value, labels) on each update, to forward the metrics
+    to another system. toPrometheus() returns the Prometheus text exposition format.
+
+    The hydro_api and winter_credit modules record in the module level ``metrics`` registry:
+
+    * hydro_request_duration_seconds{endpoint, url}: histogram of the HTTP calls, retries included
+    * hydro_request_errors_total{endpoint, reason}: failed calls (timeout, connection, status, circuit_open)
+    * hydro_request_retries_total{endpoint}: retried attempts
+    * hydro_login_stage_duration_seconds{stage}: histogram of each login stage
+    * hydro_cache_requests_total{endpoint, result}: cache lookups (hit, miss, revalidated, stale)
+    * winter_credit_refresh_checks_total / winter_credit_refreshes_total{result}: data refreshes
+    * winter_credit_refresh_duration_seconds: histogram of the data refreshes
+    * winter_credit_state_duration_seconds: histogram of the getCurrentState() evaluations
+
+    The hydro_cache_hit_ratio{endpoint} gauge is calculated from the cache lookups when exporting.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def addCallback(self, callback):
+        """Call callback(kind, name, value, labels) on each update"""
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback):
+        self.callbacks.remove(callback)
+
+    def _series(self, kind, name, labels):
+        metric = self.metrics.setdefault(name, {'kind': kind, 'series': {}})
+        if metric['kind'] != kind:
+            raise ValueError('%s is a %s' % (name, metric['kind']))
+        return metric['series'], tuple(sorted(labels.items()))
+
+    def _notify(self, kind, name, value, labels):
+        for callback in self.callbacks:
+            try:
+                callback(kind, name, value, labels)
+            except Exception:
+                log.exception('metrics callback failed')
+
+    def increment(self, name, value=1, **labels):
+        """Add value to a counter"""
+        with self.lock:
+            series, key = self._series(COUNTER, name, labels)
+            series[key] = series.get(key, 0) + value
+        self._notify(COUNTER, name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """Add a value to a histogram"""
+        with self.lock:
+            series, key = self._series(HISTOGRAM, name, labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+        self._notify(HISTOGRAM, name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of a block in seconds, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """Return the value of a counter or the Histogram object, None if nothing was recorded"""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                return None
+            return metric['series'].get(tuple(sorted(labels.items())))
+
+    def cacheHitRatio(self, endpoint):
+        """Share of the cache lookups of an endpoint answered without downloading the response
+
+        :rtype: float
+        """
+        with self.lock:
+            lookups = self.metrics.get('hydro_cache_requests_total', {'series': {}})['series']
+            hits = total = 0
+            for key, value in lookups.items():
+                labels = dict(key)
+                if labels.get('endpoint') != endpoint:
+                    continue
+                total += value
+                if labels.get('result') in ('hit', 'revalidated'):
+                    hits += value
+        return hits / total if total else 0.0
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}
+
+    def _formatLabels(self, labels, extra=None):
+        labels = list(labels) + (extra or [])
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for key, value in labels)
+
+    def toPrometheus(self):
+        """Return every metric in the Prometheus text exposition format
+
+        :rtype: str
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.metrics):
+                metric = self.metrics[name]
+                lines.append('# TYPE %s %s' % (name, metric['kind']))
+                for key, value in sorted(metric['series'].items()):
+                    if metric['kind'] == COUNTER:
+                        lines.append('%s%s %s' % (name, self._formatLabels(key), value))
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append('%s_bucket%s %s' % (name, self._formatLabels(key, [('le', bound)]), count))
+                    lines.append('%s_bucket%s %s' % (name, self._formatLabels(key, [('le', '+Inf')]), value.count))
+                    lines.append('%s_sum%s %s' % (name, self._formatLabels(key), value.sum))
+                    lines.append('%s_count%s %s' % (name, self._formatLabels(key), value.count))
+            endpoints = sorted({dict(key).get('endpoint') for key in
+                                self.metrics.get('hydro_cache_requests_total', {'series': {}})['series']})
+        if endpoints:
+            lines.append('# TYPE hydro_cache_hit_ratio gauge')
+            for endpoint in endpoints:
+                lines.append('hydro_cache_hit_ratio%s %s' % (self._formatLabels([('endpoint', endpoint)]),
+                                                             self.cacheHitRatio(endpoint)))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def startServer(port, registry=None, address=''):
+    """Serve the Prometheus metrics on http://address:port/metrics from a background thread
+
+    :param: port: listening port
+    :param: registry: Metrics object, defaults to the module registry
+
+    :return: the server, call shutdown() to stop it
+
+    :rtype: ThreadingHTTPServer
+    """
+    # http.server is only needed by the processes serving their metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    registry = registry or metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.toPrometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info('serving metrics on port %s' % port)
+    return server
@@ -0,0 +1,204 @@
+"""
+Columnar consumption time series
+"""
+import datetime
+import math
+from array import array
+from bisect import bisect_left
+
+from .consumption import daily_record
+
+MISSING = float('nan')
+
+
+def _value(value):
+    return MISSING if value is None else float(value)
+
+
+class ConsumptionSeries:
+    """Consumption records stored in three typed columns
+
+    The timestamps, kwh and temperatures are stored as contiguous ``array('d')`` columns ordered by
+    timestamp, a missing kwh or temperature is stored as NaN. A series is not modified once built:
+    :meth:`between` returns a series sharing the columns of its parent through memoryviews, and the columns
+    support the buffer protocol so they can be used as NumPy arrays without copy, see :meth:`to_numpy`.
+
+    Rows are returned as the records of :mod:`hydro_api.consumption` by indexing or iterating,
+    only use them for a few rows.
+
+    :param: timestamps: array('d') or memoryview of unix timestamps, ordered
+    :param: kwh: array('d') or memoryview of the consumption
+    :param: temperatures: array('d') or memoryview of the temperatures
+
+    :example:
+
+        ::
+
+            series = ConsumptionSeries.fromHourly(services.getHourlyConsumption(day) for day in days)
+            week = series.between(start_ts, end_ts)
+            columns = week.to_numpy()
+            columns['kwh'].sum()
+    """
+
+    __slots__ = ('timestamps', 'kwh', 'temperatures')
+
+    def __init__(self, timestamps, kwh, temperatures):
+        if not len(timestamps) == len(kwh) == len(temperatures):
+            raise ValueError('columns must have the same length')
+        self.timestamps = memoryview(timestamps)
+        self.kwh = memoryview(kwh)
+        self.temperatures = memoryview(temperatures)
+
+    @classmethod
+    def fromColumns(cls, timestamps, kwh, temperatures=None):
+        """Build a series from sequences of values, the rows are sorted by timestamp
+
+        :param: timestamps: unix timestamps
+        :param: kwh: consumption, None for missing values
+        :param: temperatures: temperatures, None for missing values
+
+        :rtype: ConsumptionSeries
+        """
+        timestamps = array('d', timestamps)
+        kwh = array('d', map(_value, kwh))
+        if temperatures is None:
+            temperatures = array('d', [MISSING]) * len(timestamps)
+        else:
+            temperatures = array('d', map(_value, temperatures))
+        if any(timestamps[index] > timestamps[index + 1] for index in range(len(timestamps) - 1)):
+            order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+            timestamps = array('d', [timestamps[index] for index in order])
+            kwh = array('d', [kwh[index] for index in order])
+            temperatures = array('d', [temperatures[index] for index in order])
+        return cls(timestamps, kwh, temperatures)
+
+    @classmethod
+    def fromRecords(cls, records):
+        """Build a series from normalized records, see :mod:`hydro_api.consumption`
+
+        :param: records: iterable of records, a generator is read once
+
+        :rtype: ConsumptionSeries
+        """
+        timestamps = array('d')
+        kwh = array('d')
+        temperatures = array('d')
+        for record in records:
+            timestamps.append(record['timestamp'])
+            kwh.append(_value(record['kwh']))
+            temperatures.append(_value(record['temperature']))
+        return cls.fromColumns(timestamps, kwh, temperatures)
+
+    @classmethod
+    def fromHourly(cls, responses):
+        """Build a series from getHourlyConsumption responses
+
+        :param: responses: raw JSON responses of Services.getHourlyConsumption, one per day
+
+        :rtype: ConsumptionSeries
+        """
+        if isinstance(responses, dict):
+            responses = [responses]
+        timestamps = array('d')
+        kwh = array('d')
+        for data in responses:
+            try:
+                results = data['results']
+                date = results['dateJour'][:10]
+                entries = results['listeDonneesConsoEnergieHoraire']
+            except (KeyError, TypeError):
+                continue
+            day = datetime.date.fromisoformat(date)
+            for entry in entries:
+                hour = datetime.time.fromisoformat(entry['heure'])
+                timestamps.append(datetime.datetime.combine(day, hour).timestamp())
+                kwh.append(_value(entry.get('consoTotal')))
+        return cls.fromColumns(timestamps, kwh)
+
+    @classmethod
+    def fromDaily(cls, responses):
+        """Build a series from getDailyConsumption responses
+
+        :param: responses: raw JSON response of Services.getDailyConsumption or a list of them
+
+        :rtype: ConsumptionSeries
+        """
+        if isinstance(responses, dict):
+            responses = [responses]
+        timestamps = array('d')
+        kwh = array('d')
+        temperatures = array('d')
+        for data in responses:
+            try:
+                entries = data['results'] or []
+            except (KeyError, TypeError):
+                continue
+            for entry in entries:
+                record = daily_record(entry)
+                timestamps.append(record['timestamp'])
+                kwh.append(_value(record['kwh']))
+                temperatures.append(_value(record['temperature']))
+        return cls.fromColumns(timestamps, kwh, temperatures)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        """Return the record of a row, see :mod:`hydro_api.consumption`
+
+        :rtype: dict
+        """
+        timestamp = self.timestamps[index]
+        kwh = self.kwh[index]
+        temperature = self.temperatures[index]
+        return {
+            'timestamp': timestamp,
+            'date': datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d'),
+            'kwh': None if math.isnan(kwh) else kwh,
+            'temperature': None if math.isnan(temperature) else temperature
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def between(self, start_ts, end_ts):
+        """Return the rows of a [start_ts, end_ts) time range, the columns are not copied
+
+        :param: start_ts: range start unix timestamp
+        :param: end_ts: range end unix timestamp
+
+        :rtype: ConsumptionSeries
+        """
+        start = bisect_left(self.timestamps, start_ts)
+        end = bisect_left(self.timestamps, end_ts, lo=start)
+        return ConsumptionSeries(self.timestamps[start:end], self.kwh[start:end], self.temperatures[start:end])
+
+    def total(self):
+        """Total consumption of the series in kWh, missing values are ignored
+
+        :rtype: float
+        """
+        return math.fsum(value for value in self.kwh if not math.isnan(value))
+
+    def to_numpy(self):
+        """Return the columns as read only NumPy arrays sharing the memory of the series
+
+        :return: {'timestamps': ndarray, 'kwh': ndarray, 'temperatures': ndarray}
+
+        :rtype: dict
+        """
+        import numpy as np
+        columns = {}
+        for name in ('timestamps', 'kwh', 'temperatures'):
+            column = np.frombuffer(getattr(self, name), dtype=np.float64)
+            column.flags.writeable = False
+            columns[name] = column
+        return columns
+
+    def to_records(self):
+        """Return the records of every row, see :mod:`hydro_api.consumption`
+
+        :rtype: list
+        """
+        return list(self)
@@ -5,50 +5,228 @@ Wrappers to API calls and associated post processing
 
 import logging
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 import datetime
 
-from config.config import Config
-from .auth import Hydro
+from config.config import get_config
+from .auth import Hydro, LoginError
+from .cache import ResponseCache
+from .consumption import daily_complete, daily_records, daily_valid, hourly_complete, hourly_valid, \
+    iter_daily_records, merge_daily, split_range
+from .metrics import metrics
+from .transport import TransportError
 
 log = logging.getLogger(__name__)
 
 class Services:
     """
     Hydro Quebec API services
+
+    Responses are cached with a freshness per endpoint (cache section of the config). Past days
+    consumption never changes and is cached without expiration. Stale entries are revalidated with
+    ETag / Last-Modified when hydro provided them.
+
+    When hydro does not answer (see :class:`hydro_api.transport.Transport`), the last cached response is
+    returned even if it is stale. The TransportError is raised when nothing was cached.
+
+    Creating the object does not send anything to hydro, the login is done by the first data call. A LoginError
+is raised when the login fails. When hydro rejects the session (401, 403 or a response that is not JSON, such
+as the login page), the call raises a LoginError and the next call logs in again.
+
+    :param: cache: object with get(key) / set(key, entry) methods, see :mod:`hydro_api.cache`.
+                   Defaults to the cache described in the config.
+    :param: user: hydro account, defaults to the config credentials
+    :param: password: hydro account password, defaults to the config credentials
     """
-    def __init__(self):
-        self.auth = Hydro()
-        self.auth.login()
-        self.api_headers = self.auth.get_api_headers()
-        self.session = self.auth.session
-        self.config = Config()
+
+    WINTER_CREDIT_URL = "https://cl-services.idp.hydroquebec.com/cl/prive/api/v3_0/tarificationDynamique/" \
+                        "creditPointeCritique"
+    HOURLY_CONSUMPTION_URL = "https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/" \
+                             "portrait-de-consommation/resourceObtenirDonneesConsommationHoraires/"
+    DAILY_CONSUMPTION_URL = "https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/" \
+                            "portrait-de-consommation/resourceObtenirDonneesQuotidiennesConsommation"
+
+    # Bytes read at a time by the streaming methods
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, cache=None, user=None, password=None):
+        self.config = get_config()
+        self.user = user
+        self.password = password
+        self.cache = cache if cache is not None else ResponseCache.fromConfig(self.config)
+        self.auth = None
+        # Set when hydro rejected the session, the next call logs in again
+        self.session_rejected = False
+        self.api_headers = {}
+        self.session = None
+        self.login_lock = threading.Lock()
+
+    def login(self):
+        """Login to hydro, also used to start a new session once the current one expired
+
+        :raises LoginError: the login failed
+        """
+        auth = Hydro(user=self.user, password=self.password)
+        if not auth.login():
+            raise LoginError('unable to login to hydro as %s' % auth.user)
+        self.api_headers = auth.get_api_headers()
+        self.session = auth.session
+        self.auth = auth
+        self.session_rejected = False
+
+    def _checkLogin(self):
+        """Login on the first data call and after hydro rejected the session"""
+        if self.auth is None or self.session_rejected:
+            with self.login_lock:
+                if self.auth is None or self.session_rejected:
+                    self.login()
+
+    def _rejectSession(self, session, reason):
+        """Login again on the next call, unless another call already did
+
+        :param: session: session the rejected request was sent with
+        :param: reason: cause, for the error message
+
+        :raises LoginError: always
+        """
+        with self.login_lock:
+            if self.session is session:
+                self.session_rejected = True
+        raise LoginError('hydro rejected the session: %s' % reason)
+
+    @property
+    def contract_id(self):
+        """Contract id of the account, logs in if needed"""
+        self._checkLogin()
+        return self.auth.contract_id
+
+    def _cacheKey(self, url, params):
+        return "%s|%s?%s" % (self.auth.contract_id, url, urlencode(sorted(params.items())))
+
+    def _isFresh(self, entry):
+        return entry['expires'] is None or entry['expires'] > time.time()
+
+    def _getFresh(self, url, params):
+        """Return the cached response if it is still fresh, None otherwise"""
+        if self.cache is None:
+            return None
+        entry = self.cache.get(self._cacheKey(url, params))
+        if entry is not None and self._isFresh(entry):
+            return entry['data']
+        return None
+
+    def _get(self, url, params, ttl, endpoint, headers=None, refresh=False, valid=None, complete=None):
+        """GET a JSON resource through the response cache
+
+        :param: url: resource url
+        :param: params: query parameters
+        :param: ttl: freshness in seconds, None for no expiration, 0 to bypass the cache
+        :param: endpoint: key of the http.timeouts config parameter
+        :param: headers: request headers
+        :param: refresh: ignore a fresh cached entry and ask hydro
+        :param: valid: function returning False for a response that must not be cached (error payload)
+        :param: complete: function returning False for a response missing data, it is cached with the
+            {endpoint}_ttl freshness of the cache config instead of without expiration
+
+        :return: decoded JSON
+        """
+        key = None
+        entry = None
+        request_headers = dict(headers or {})
+        if self.cache is not None and ttl != 0:
+            key = self._cacheKey(url, params)
+            entry = self.cache.get(key)
+            if entry is not None:
+                if not refresh and self._isFresh(entry):
+                    log.debug('cache hit %s' % key)
+                    metrics.increment('hydro_cache_requests_total', endpoint=endpoint, result='hit')
+                    return entry['data']
+                if entry.get('etag'):
+                    request_headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    request_headers['If-Modified-Since'] = entry['last_modified']
+
+        session = self.session
+        try:
+            api_call_response = session.get(url, params=params, headers=request_headers,
+                                                 verify=self.config.ssl.validate_ssl, endpoint=endpoint)
+            if api_call_response.status_code >= 500:
+                raise TransportError('%s returned %s' % (url, api_call_response.status_code))
+        except TransportError as e:
+            if entry is None:
+                raise
+            log.warning('%s, using the last response received' % e)
+            metrics.increment('hydro_cache_requests_total', endpoint=endpoint, result='stale')
+            return entry['data']
+        if api_call_response.status_code in (401, 403):
+            self._rejectSession(session, '%s returned %s' % (url, api_call_response.status_code))
+        if entry is not None and api_call_response.status_code == 304:
+            log.debug('cache revalidated %s' % key)
+            metrics.increment('hydro_cache_requests_total', endpoint=endpoint, result='revalidated')
+            data = entry['data']
+        else:
+            if key is not None:
+                metrics.increment('hydro_cache_requests_total', endpoint=endpoint, result='miss')
+            try:
+                data = json.loads(api_call_response.text)
+            except ValueError:
+                self._rejectSession(session, '%s did not return JSON' % url)
+        if key is not None and api_call_response.status_code in (200, 304):
+            if valid is not None and not valid(data):
+                log.debug('not caching unexpected response %s' % key)
+                return data
+            if ttl is None and complete is not None and not complete(data):
+                # Hydro has not published the whole period yet, ask again later
+                ttl = getattr(self.config.cache, '%s_ttl' % endpoint)
+            self.cache.set(key, {
+                'data': data,
+                'expires': None if ttl is None else time.time() + ttl,
+                'etag': api_call_response.headers.get('ETag'),
+                'last_modified': api_call_response.headers.get('Last-Modified')
+            })
+        return data
+
+    def _consumptionTtl(self, date, ttl):
+        """Past days are final and never expire, recent ones use the endpoint freshness"""
+        final_date = datetime.date.today() - datetime.timedelta(days=self.config.cache.final_after_days)
+        if date <= final_date.strftime('%Y-%m-%d'):
+            return None
+        return ttl
 
     def getWinterCredit(self):
         """Return information about the winter credit
 
         :return: raw JSON from hydro QC API
         """
-        API_URL = "https://cl-services.idp.hydroquebec.com/cl/prive/api/v3_0/tarificationDynamique/creditPointeCritique"
         params = {
-            'noContrat': self.auth.contract_id
+            'noContrat': self.contract_id
         }
-        api_call_response = self.session.get(API_URL, headers=self.api_headers, params=params,
-                                             verify=self.config.ssl.validate_ssl)
-        return json.loads(api_call_response.text)
+        return self._get(self.WINTER_CREDIT_URL, params, self.config.cache.winter_credit_ttl, 'winter_credit',
+                         headers=self.api_headers)
 
     def getTodayHourlyConsumption(self):
         """Return latest consumption info (about 2h delay it seems)
 
         :return: raw JSON from hydro QC API for current day (not officially supported, data delayed)
         """
+        self._checkLogin()
         date = datetime.date
         today = date.today().strftime('%Y-%m-%d')
         yesterday = (date.today() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        data = self._getFresh(self.HOURLY_CONSUMPTION_URL, {'date': today})
+        if data is not None:
+            return data
         # We need to call a valid date first as theoretically today is invalid
-        # and the api will not respond if called directly
-        self.getHourlyConsumption(yesterday)
-        return self.getHourlyConsumption(today)
+        # and the api will not respond if called directly, the cache must not answer in place of hydro
+        self._get(self.HOURLY_CONSUMPTION_URL, {'date': yesterday},
+                  self._consumptionTtl(yesterday, self.config.cache.hourly_ttl), 'hourly', refresh=True,
+                  valid=hourly_valid, complete=hourly_complete)
+        return self._get(self.HOURLY_CONSUMPTION_URL, {'date': today}, self.config.cache.hourly_ttl, 'hourly',
+                         refresh=True, valid=hourly_valid)
 
     def getHourlyConsumption(self, date):
         """Return hourly consumption for a specific day
@@ -57,29 +235,90 @@ class Services:
 
         :return: raw JSON from hydro QC API
         """
-        API_URL = 'https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/portrait-de-consommation' \
-                  '/resourceObtenirDonneesConsommationHoraires/'
-        api_call_response = self.session.get(API_URL, params={'date': date},
-                                             verify=self.config.ssl.validate_ssl)
+        self._checkLogin()
+        return self._get(self.HOURLY_CONSUMPTION_URL, {'date': date},
+                         self._consumptionTtl(date, self.config.cache.hourly_ttl), 'hourly',
+                         valid=hourly_valid, complete=hourly_complete)
 
-        return json.loads(api_call_response.text)
+    def _getDailyWindow(self, start_date, end_date):
+        params = {
+            'dateDebut': start_date,
+            'dateFin': end_date
+        }
+        return self._get(self.DAILY_CONSUMPTION_URL, params,
+                         self._consumptionTtl(end_date, self.config.cache.daily_ttl), 'daily', valid=daily_valid,
+                         complete=lambda data: daily_complete(data, start_date, end_date))
 
     def getDailyConsumption(self, start_date,end_date):
-        """Return hourly consumption for a specific day
+        """Return daily consumption for a range of days
+
+        Ranges longer than http.daily_window_days are split into windows fetched in parallel (at most
+        http.daily_parallel_requests at a time) over the same session. The responses are merged into one,
+        ordered by date without duplicates. Each window is cached separately.
 
         :param: start_date: YYYY-MM-DD string to pass to API
         :param: end_date: YYYY-MM-DD string to pass to API
 
         :return: raw JSON from hydro QC API
         """
-        API_URL = 'https://cl-ec-spring.hydroquebec.com/portail/fr/group/clientele/portrait-de-consommation' \
-                  '/resourceObtenirDonneesQuotidiennesConsommation'
+        self._checkLogin()
+        windows = split_range(start_date, end_date, self.config.http.daily_window_days)
+        if len(windows) == 1:
+            return self._getDailyWindow(start_date, end_date)
+        log.debug('fetching %s to %s in %s windows' % (start_date, end_date, len(windows)))
+        workers = min(len(windows), self.config.http.daily_parallel_requests)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hydro-daily') as executor:
+            responses = list(executor.map(lambda window: self._getDailyWindow(*window), windows))
+        return merge_daily(responses, start_date, end_date)
+
+    def iterDailyConsumption(self, start_date, end_date):
+        """Yield the normalized daily consumption records of a range of days while they are downloaded
+
+        The response is parsed from the received bytes, only one record is kept in memory. A fresh cached
+        response is used when there is one, the streamed responses are not cached. The request is sent
+        when the first record is requested. Long ranges are fetched one http.daily_window_days window
+        after the other.
+
+        :param: start_date: YYYY-MM-DD string to pass to API
+        :param: end_date: YYYY-MM-DD string to pass to API
+
+        :return: generator of records, see :mod:`hydro_api.consumption`
+        """
+        self._checkLogin()
+        for window in split_range(start_date, end_date, self.config.http.daily_window_days):
+            yield from self._iterDailyWindow(*window)
+
+    def _iterDailyWindow(self, start_date, end_date):
         params = {
             'dateDebut': start_date,
             'dateFin': end_date
         }
-        api_call_response = self.session.get(API_URL, params=params,
-                                             verify=self.config.ssl.validate_ssl)
-
-        return json.loads(api_call_response.text)
-
+        data = self._getFresh(self.DAILY_CONSUMPTION_URL, params)
+        if data is not None:
+            metrics.increment('hydro_cache_requests_total', endpoint='daily', result='hit')
+            yield from daily_records(data)
+            return
+        session = self.session
+        try:
+            response = session.get(self.DAILY_CONSUMPTION_URL, params=params,
+                                        verify=self.config.ssl.validate_ssl, endpoint='daily', stream=True)
+            if response.status_code >= 500:
+                response.close()
+                raise TransportError('%s returned %s' % (self.DAILY_CONSUMPTION_URL, response.status_code))
+        except TransportError as e:
+            entry = self.cache.get(self._cacheKey(self.DAILY_CONSUMPTION_URL, params)) \
+                if self.cache is not None else None
+            if entry is None:
+                raise
+            log.warning('%s, using the last response received' % e)
+            metrics.increment('hydro_cache_requests_total', endpoint='daily', result='stale')
+            yield from daily_records(entry['data'])
+            return
+        if response.status_code in (401, 403):
+            response.close()
+            self._rejectSession(session, '%s returned %s' % (self.DAILY_CONSUMPTION_URL, response.status_code))
+        with response:
+            try:
+                yield from iter_daily_records(response.iter_content(self.STREAM_CHUNK_SIZE))
+            except ValueError:
+                self._rejectSession(session, '%s did not return JSON' % self.DAILY_CONSUMPTION_URL)
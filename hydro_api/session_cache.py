@@ -0,0 +1,88 @@
+"""
+Persistent storage of the Hydro session between runs
+"""
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+
+class SessionCache:
+    """
+    On disk session store
+
+    Keeps the cookies, the access token and the account information gathered during the login
+    so that a new process can reuse them instead of performing the full login chain.
+    The file contains credentials equivalent data and is created readable by the owner only.
+    """
+
+    FIELDS = ('oauth2_settings', 'access_token', 'token_expiry', 'guid',
+              'account_id', 'customer_id', 'contract_id')
+
+    def __init__(self, path, max_age):
+        self.path = path
+        self.max_age = max_age
+
+    def load(self):
+        """Read the cached session
+
+        :return: cached session or None if there is no usable session on disk
+
+        :rtype: dict
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            log.warning('unable to read session cache %s' % self.path)
+            return None
+
+        now = time.time()
+        if data.get('saved_at', 0) + self.max_age < now:
+            log.debug('cached session is too old')
+            return None
+        if data.get('token_expiry') and data['token_expiry'] < now:
+            log.debug('cached access token is expired')
+            return None
+        if any(field not in data for field in self.FIELDS + ('cookies',)):
+            return None
+        return data
+
+    def save(self, hydro, saved_at=None):
+        """Write the current session of a Hydro object to disk
+
+        :param: hydro: logged in Hydro object
+        :param: saved_at: login time of the session, defaults to now (new session)
+        """
+        data = {field: getattr(hydro, field) for field in self.FIELDS}
+        data['saved_at'] = time.time() if saved_at is None else saved_at
+        data['cookies'] = [
+            {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'expires': cookie.expires,
+                'secure': cookie.secure
+            }
+            for cookie in hydro.session.cookies
+        ]
+        tmp_path = self.path + '.tmp'
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            log.error('unable to write session cache %s' % self.path)
+
+    def clear(self):
+        """Remove the cached session"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
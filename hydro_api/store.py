@@ -0,0 +1,212 @@
+"""
+Local consumption store
+"""
+import datetime
+import logging
+import sqlite3
+import time
+from array import array
+
+from config.config import get_config
+from .consumption import hourly_complete, hourly_records
+from .series import MISSING, ConsumptionSeries
+
+log = logging.getLogger(__name__)
+
+
+class ConsumptionStore:
+    """
+    SQLite store of the hourly and daily consumption
+
+    Records are keyed by contract and timestamp. Every fetched day is tracked with a ``final`` flag:
+    days older than ``store.final_after_days`` will not change anymore on hydro side and are never
+    fetched again once hydro returned a value for each of their hours, more recent or incomplete days
+    are fetched again on every :meth:`sync`.
+
+    :param: path: SQLite database file, defaults to ``store.path``
+
+    :example:
+
+        ::
+
+            store = ConsumptionStore()
+            store.sync(Services(), '2022-01-01', '2022-01-31')
+            records = store.getHourly(contract_id, start_ts, end_ts)
+    """
+
+    HOURLY = 'hourly'
+    DAILY = 'daily'
+
+    def __init__(self, path=None):
+        self.config = get_config()
+        self.path = path or self.config.store.path
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            for table in (self.HOURLY, self.DAILY):
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS %s ("
+                    "contract_id TEXT NOT NULL, timestamp REAL NOT NULL, date TEXT NOT NULL, "
+                    "kwh REAL, temperature REAL, PRIMARY KEY (contract_id, timestamp)) WITHOUT ROWID" % table
+                )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS days ("
+                "contract_id TEXT NOT NULL, kind TEXT NOT NULL, date TEXT NOT NULL, "
+                "final INTEGER NOT NULL, fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (contract_id, kind, date)) WITHOUT ROWID"
+            )
+
+    def close(self):
+        self.db.close()
+
+    def _isFinal(self, date):
+        limit = datetime.date.today() - datetime.timedelta(days=self.config.store.final_after_days)
+        return date <= limit.isoformat()
+
+    def missingDays(self, contract_id, kind, start_date, end_date):
+        """Return the days of the range that are not stored or not final yet
+
+        :param: contract_id: hydro contract id
+        :param: kind: ConsumptionStore.HOURLY or ConsumptionStore.DAILY
+        :param: start_date: YYYY-MM-DD string
+        :param: end_date: YYYY-MM-DD string, days after today are ignored
+
+        :rtype: list
+        """
+        final_days = {row['date'] for row in self.db.execute(
+            "SELECT date FROM days WHERE contract_id = ? AND kind = ? AND final = 1 AND date BETWEEN ? AND ?",
+            (contract_id, kind, start_date, end_date)
+        )}
+        day = datetime.date.fromisoformat(start_date)
+        last = min(datetime.date.fromisoformat(end_date), datetime.date.today())
+        days = []
+        while day <= last:
+            if day.isoformat() not in final_days:
+                days.append(day.isoformat())
+            day += datetime.timedelta(days=1)
+        return days
+
+    def _save(self, contract_id, kind, dates, records, complete=True):
+        """Store the records of days, the old enough days with data are marked final
+
+        :param: complete: False if the response of the days is missing values, they stay not final
+        """
+        now = time.time()
+        dates_with_data = set()
+
+        def rows():
+            # records can be a generator, it is read only once
+            for r in records:
+                if r['kwh'] is not None:
+                    dates_with_data.add(r['date'])
+                yield contract_id, r['timestamp'], r['date'], r['kwh'], r['temperature']
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO %s (contract_id, timestamp, date, kwh, temperature) "
+                "VALUES (?, ?, ?, ?, ?)" % kind,
+                rows()
+            )
+            # A day without any value is kept as not final so it is fetched again
+            self.db.executemany(
+                "INSERT OR REPLACE INTO days (contract_id, kind, date, final, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                [(contract_id, kind, date, int(complete and date in dates_with_data and self._isFinal(date)), now)
+                 for date in dates]
+            )
+
+    def sync(self, services, start_date, end_date):
+        """Fetch the missing and not final days of the range from hydro
+
+        Hourly days are fetched one by one in chronological order, daily data in one request
+        covering the missing days.
+
+        :param: services: Services object
+        :param: start_date: YYYY-MM-DD string
+        :param: end_date: YYYY-MM-DD string
+
+        :return: number of Services calls, the responses found in the Services cache included
+
+        :rtype: int
+        """
+        contract_id = services.contract_id
+        calls = 0
+
+        for date in self.missingDays(contract_id, self.HOURLY, start_date, end_date):
+            try:
+                data = services.getHourlyConsumption(date)
+            except Exception:
+                log.error('unable to fetch hourly consumption for %s' % date)
+                continue
+            calls += 1
+            self._save(contract_id, self.HOURLY, [date], hourly_records(data), complete=hourly_complete(data))
+
+        missing = self.missingDays(contract_id, self.DAILY, start_date, end_date)
+        if missing:
+            try:
+                records = services.iterDailyConsumption(missing[0], missing[-1])
+                calls += 1
+                self._save(contract_id, self.DAILY, missing,
+                           (r for r in records if missing[0] <= r['date'] <= missing[-1]))
+            except Exception:
+                log.error('unable to fetch daily consumption from %s to %s' % (missing[0], missing[-1]))
+
+        log.debug('%s calls to sync %s to %s' % (calls, start_date, end_date))
+        return calls
+
+    def _query(self, kind, contract_id, start_ts, end_ts):
+        return [dict(row) for row in self.db.execute(
+            "SELECT timestamp, date, kwh, temperature FROM %s "
+            "WHERE contract_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp" % kind,
+            (contract_id, start_ts, end_ts)
+        )]
+
+    def getHourly(self, contract_id, start_ts, end_ts):
+        """Return the stored hourly records of a time range
+
+        :param: contract_id: hydro contract id
+        :param: start_ts: range start, unix timestamp included
+        :param: end_ts: range end, unix timestamp excluded
+
+        :return: records ordered by timestamp, see :mod:`hydro_api.consumption`
+
+        :rtype: list
+        """
+        return self._query(self.HOURLY, contract_id, start_ts, end_ts)
+
+    def getDaily(self, contract_id, start_ts, end_ts):
+        """Return the stored daily records of a time range
+
+        :param: contract_id: hydro contract id
+        :param: start_ts: range start, unix timestamp included
+        :param: end_ts: range end, unix timestamp excluded
+
+        :return: records ordered by timestamp, see :mod:`hydro_api.consumption`
+
+        :rtype: list
+        """
+        return self._query(self.DAILY, contract_id, start_ts, end_ts)
+
+    def getSeries(self, kind, contract_id, start_ts, end_ts):
+        """Return the stored records of a time range as a ConsumptionSeries, without building the records
+
+        :param: kind: ConsumptionStore.HOURLY or ConsumptionStore.DAILY
+        :param: contract_id: hydro contract id
+        :param: start_ts: range start, unix timestamp included
+        :param: end_ts: range end, unix timestamp excluded
+
+        :rtype: hydro_api.series.ConsumptionSeries
+        """
+        timestamps = array('d')
+        kwh = array('d')
+        temperatures = array('d')
+        cursor = self.db.cursor()
+        # Plain tuples instead of sqlite3.Row
+        cursor.row_factory = None
+        for timestamp, row_kwh, temperature in cursor.execute(
+                "SELECT timestamp, kwh, temperature FROM %s "
+                "WHERE contract_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp" % kind,
+                (contract_id, start_ts, end_ts)):
+            timestamps.append(timestamp)
+            kwh.append(MISSING if row_kwh is None else row_kwh)
+            temperatures.append(MISSING if temperature is None else temperature)
+        return ConsumptionSeries(timestamps, kwh, temperatures)
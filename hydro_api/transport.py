@@ -0,0 +1,207 @@
+"""
+HTTP transport with latency budgets, retries and circuit breakers
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Responses worth retrying, the portal returns them while it is overloaded or in maintenance
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+class TransportError(Exception):
+    """The request failed, retries included"""
+
+
+class CircuitOpenError(TransportError):
+    """The host is considered down, the request was not sent"""
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a host is down
+
+    The circuit opens after failure_threshold consecutive failures. While it is open, requests are refused
+    without being sent. After reset_timeout seconds a single trial request is let through, the circuit
+    closes if it succeeds and opens again otherwise.
+
+    :param: failure_threshold: consecutive failures opening the circuit
+    :param: reset_timeout: seconds before a trial request is allowed
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request can be sent
+
+        :rtype: bool
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() >= self.opened_at + self.reset_timeout:
+                # Let a single request test the host
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def recordSuccess(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    log.warning('circuit opened after %s failures' % self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+
+# Breakers are shared by every transport of the process, a new login must not forget that hydro is down
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def getBreaker(host, failure_threshold, reset_timeout):
+    """Return the circuit breaker of a host
+
+    :rtype: CircuitBreaker
+    """
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(failure_threshold, reset_timeout)
+        return _breakers[host]
+
+
+class Transport:
+    """
+    requests.Session wrapper used for every hydro call
+
+    * each request gets a latency budget depending on its endpoint (http.timeouts in the config), the
+      attempts and the waits between them all fit in the budget
+    * connection errors, timeouts and 5xx responses are retried with exponential backoff and full jitter,
+      only GET requests are retried unless retry=True is given
+    * each host has a circuit breaker, a CircuitOpenError is raised without sending the request while the
+      host is down
+
+    get() and post() accept the requests arguments plus endpoint (key of http.timeouts) and retry.
+    A TransportError is raised when the request fails, a 5xx response is returned once the retries
+    are exhausted.
+
+    The requests module is only imported when the first request is sent.
+
+    :param: config: Config object
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._session = None
+
+    @property
+    def session(self):
+        """requests.Session, created on first use"""
+        if self._session is None:
+            import requests
+            if not self.config.ssl.validate_ssl:
+                from urllib3.exceptions import InsecureRequestWarning
+                requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+            self._session = requests.Session()
+        return self._session
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def _timeout(self, endpoint):
+        timeouts = self.config.http.timeouts
+        return timeouts.get(endpoint, timeouts['default'])
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.config.http.max_backoff, self.config.http.backoff * 2 ** attempt))
+
+    def request(self, method, url, endpoint='default', retry=None, **kwargs):
+        """Send a request
+
+        :param: method: HTTP method
+        :param: url: request url
+        :param: endpoint: key of the http.timeouts config parameter
+        :param: retry: retry failed requests, defaults to True for GET requests only
+
+        :return: response
+
+        :rtype: requests.Response
+        """
+        import requests
+        http = self.config.http
+        if retry is None:
+            retry = method.upper() == 'GET'
+        split_url = urlsplit(url)
+        breaker = getBreaker(split_url.netloc, http.breaker_failures, http.breaker_reset)
+        if not breaker.allow():
+            metrics.increment('hydro_request_errors_total', endpoint=endpoint, reason='circuit_open')
+            raise CircuitOpenError('%s is unavailable, request not sent' % split_url.netloc)
+
+        with metrics.timer('hydro_request_duration_seconds', endpoint=endpoint,
+                           url=split_url.netloc + split_url.path):
+            deadline = time.time() + self._timeout(endpoint)
+            attempts = http.retries + 1 if retry else 1
+            for attempt in range(attempts):
+                error = None
+                response = None
+                try:
+                    response = self.session.request(method, url, timeout=max(deadline - time.time(), 0.1),
+                                                    **kwargs)
+                except requests.RequestException as e:
+                    error = e
+                except BaseException:
+                    # A half open breaker would wait forever for the result of its trial request
+                    breaker.recordFailure()
+                    raise
+                if error is None and response.status_code not in RETRY_STATUS:
+                    breaker.recordSuccess()
+                    return response
+
+                delay = self._backoff(attempt)
+                if attempt + 1 == attempts or time.time() + delay >= deadline:
+                    break
+                log.debug('%s %s failed (%s), retrying in %.2fs'
+                          % (method, url, error or response.status_code, delay))
+                metrics.increment('hydro_request_retries_total', endpoint=endpoint)
+                time.sleep(delay)
+
+        breaker.recordFailure()
+        if isinstance(error, requests.Timeout):
+            reason = 'timeout'
+        elif error is not None:
+            reason = 'connection'
+        else:
+            reason = 'status'
+        metrics.increment('hydro_request_errors_total', endpoint=endpoint, reason=reason)
+        if error is not None:
+            raise TransportError('%s %s failed: %s' % (method, url, error)) from error
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -1,69 +1,199 @@
 #!/usr/bin/env python
 """
-MQTT test publisher
+MQTT publisher
 
-This will publish only once and exit
+By default this will publish once and exit.
+With --daemon the MQTT connection and the hydro session are kept open, the state is evaluated every
+mqtt.publish_interval seconds and at each state transition, only the topics whose value changed are published.
 """
 
-import paho.mqtt.client as paho
+import argparse
 import datetime
+import json
+import logging
 import time
-from config.config import Config
+
+import paho.mqtt.client as paho
+from config.config import get_config
+from hydro_api.metrics import startServer
 from winter_credit.winter_credit import WinterCredit
 from winter_credit.event import Event
+from winter_credit.scheduler import TRANSITION_DELAY
+
+log = logging.getLogger(__name__)
+
+
+class Publisher:
+    """Publish the winter credit state of a contract to MQTT
+
+    Topics are {base_topic}/{contract_id}/winterpeaks/#. In daemon mode the availability topic is set
+    as Last Will so subscribers know when the publisher is gone.
+    """
+
+    SECTIONS = ('state', 'next', 'today/anchor_periods', 'today/peak_periods')
+
+    def __init__(self, config, winter_credit, daemon=False):
+        self.config = config
+        self.winter_credit = winter_credit
+        self.daemon = daemon
+        contract_id = winter_credit.contract_id
+        self.base_topic = "%s/%s/winterpeaks" % (config.mqtt.base_topic, contract_id)
+        self.availability_topic = "%s/availability" % self.base_topic
+        self.published = {}
+        self.pending = []
+
+        self.client = paho.Client("HydroQC-%s" % contract_id)
+        self.client.on_publish = self.on_publish
+        self.client.on_connect = self.on_connect
+        if config.mqtt.user and config.mqtt.password:
+            self.client.username_pw_set(username=config.mqtt.user, password=config.mqtt.password)
+        if daemon:
+            self.client.will_set(self.availability_topic, payload="offline", qos=1, retain=True)
+
+    def on_publish(self, client, userdata, result):
+        log.debug("data published [#%s]" % result)
+
+    def on_connect(self, client, userdata, flags, rc):
+        # After a reconnection the broker may have lost our retained values, publish everything again
+        self.published = {}
+        if self.daemon:
+            self.client.publish(self.availability_topic, payload="online", qos=1, retain=True)
+
+    def connect(self):
+        self.client.connect(self.config.mqtt.server, self.config.mqtt.port)
+        self.client.loop_start()
+
+    def disconnect(self):
+        if self.daemon:
+            self._publish(self.availability_topic, "offline")
+        for message_info in self.pending:
+            message_info.wait_for_publish()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def getTree(self):
+        """Return the values to publish as a tree following the topics layout
+
+        :rtype: dict
+        """
+        tree = {}
+        state = self.winter_credit.getCurrentState()
+        if state:
+            tree['state'] = state['state']
+            tree['next'] = dict(state['next'])
+            tree['today'] = {
+                'anchor_periods': state['anchor_periods'],
+                'peak_periods': state['peak_periods']
+            }
+        next_event_object = self.winter_credit.getNextEvent()
+        if isinstance(next_event_object, Event):
+            tree.setdefault('next', {})['critical'] = next_event_object.to_dict()
+        return tree
+
+    def _flatten(self, topic, value, messages):
+        if isinstance(value, dict):
+            for key in value:
+                self._flatten("%s/%s" % (topic, key), value[key], messages)
+        else:
+            messages[topic] = value
+
+    def _encode(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def getMessages(self):
+        """Return the values to publish according to mqtt.payload_mode
+
+        * keys: one topic per value, ex: winterpeaks/state/critical
+        * sections: one JSON document per section (state, next, today/anchor_periods, today/peak_periods)
+        * document: the whole state as a single JSON document on the winterpeaks topic
+
+        :return: topic -> value
+
+        :rtype: dict
+        """
+        tree = self.getTree()
+        messages = {}
+        payload_mode = self.config.mqtt.payload_mode
+        if payload_mode == 'document':
+            messages[self.base_topic] = self._encode(tree)
+        elif payload_mode == 'sections':
+            for section in self.SECTIONS:
+                value = tree
+                for key in section.split('/'):
+                    value = value.get(key, {})
+                if value:
+                    messages["%s/%s" % (self.base_topic, section)] = self._encode(value)
+        else:
+            self._flatten(self.base_topic, tree, messages)
+        return messages
+
+    def publish(self, changes_only=False):
+        """Publish the current state
+
+        :param: changes_only: only publish the topics whose value changed since the last call
+
+        :return: number of published topics
+
+        :rtype: int
+        """
+        count = 0
+        for topic, value in self.getMessages().items():
+            if changes_only and topic in self.published and self.published[topic] == value:
+                continue
+            self._publish(topic, value)
+            self.published[topic] = value
+            count += 1
+
+        last_update = datetime.datetime.now().strftime(self.config.formats.datetime_format)
+        self._publish("%s/last_update" % self.base_topic, last_update)
+        return count
+
+    def _publish(self, topic, value):
+        self.pending = [message_info for message_info in self.pending if not message_info.is_published()]
+        self.pending.append(self.client.publish(topic, value, qos=1, retain=True))
+
+    def run(self):
+        """Publish the changes until interrupted
+
+        The state is evaluated every mqtt.publish_interval seconds and right after each state transition.
+        """
+        interval = self.config.mqtt.publish_interval
+        while True:
+            wake_up = time.time() + interval
+            try:
+                count = self.publish(changes_only=True)
+                log.debug("%s topics changed" % count)
+                wake_up = min(wake_up, self.winter_credit.getNextTransition() + TRANSITION_DELAY)
+            except Exception:
+                # Most likely an expired hydro session, login again and retry on the next run
+                log.exception("unable to evaluate the state, logging in again")
+                try:
+                    self.winter_credit.api.login()
+                except Exception:
+                    log.exception("login failed")
+            time.sleep(max(0, wake_up - time.time()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish the winter credit state to MQTT")
+    parser.add_argument('--daemon', action='store_true', help="keep running and publish the changes")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
-config = Config()
-broker = config.mqtt.server
-port = config.mqtt.port
-user = config.mqtt.user
-password = config.mqtt.password
-base_topic = config.mqtt.base_topic
-
-w = WinterCredit()
-contract_id = w.api.auth.contract_id
-
-def on_publish(client,userdata,result):             #create function for callback
-    print("data published [#%s]" % result)
-    pass
-
-mqtt_client= paho.Client("HydroQC")
-mqtt_client.on_publish = on_publish
-if user and password:
-    mqtt_client.username_pw_set(username=user, password=password)
-mqtt_client.connect(broker,port)
-mqtt_client.loop_start()
-next_event_object = w.getNextEvent()
-if not isinstance(next_event_object,Event):
-    next_event = dict()
-else:
-    next_event = next_event_object.to_dict()
-
-
-if next_event:
-    for key in next_event.keys():
-        ret= mqtt_client.publish("%s/%s/winterpeaks/next/critical/%s" % (base_topic, contract_id,key), next_event[key], qos=1, retain=True)
-
-state = w.getCurrentState()
-if state:
-    for key in state['state'].keys():
-        ret = mqtt_client.publish("%s/%s/winterpeaks/state/%s" % (base_topic, contract_id,key), state['state'][key], qos=1, retain=True)
-    for topic in state['next'].keys():
-        for key in state['next'][topic].keys():
-            ret = mqtt_client.publish("%s/%s/winterpeaks/next/%s/%s" % (base_topic,contract_id, topic, key), state['next'][topic][key], qos=1, retain=True)
-    for topic in state['anchor_periods'].keys():
-        for key in state['anchor_periods'][topic].keys():
-            ret = mqtt_client.publish("%s/%s/winterpeaks/today/anchor_periods/%s/%s" % (base_topic,contract_id, topic, key), state['anchor_periods'][topic][key], qos=1, retain=True)
-    for topic in state['peak_periods'].keys():
-        for key in state['peak_periods'][topic].keys():
-            ret = mqtt_client.publish("%s/%s/winterpeaks/today/peak_periods/%s/%s" % (base_topic,contract_id, topic, key), state['peak_periods'][topic][key], qos=1, retain=True)
-    
-
-
-    # Last update timestamp, should probably be in the winter_credit.py
-    # TODO: Replace with proper LWT https://www.hivemq.com/blog/mqtt-essentials-part-9-last-will-and-testament/
-    now = datetime.datetime.now()
-    last_update = now.strftime("%Y-%m-%d %H:%M:%S")
-    ret = mqtt_client.publish("%s/%s/winterpeaks/last_update" % (base_topic, contract_id), payload=last_update, qos=1, retain=True)
-         
-mqtt_client.loop_stop()
-mqtt_client.disconnect()
\ No newline at end of file
+    config = get_config()
+    if args.daemon and config.metrics.port:
+        startServer(config.metrics.port)
+    publisher = Publisher(config, WinterCredit(), daemon=args.daemon)
+    publisher.connect()
+    try:
+        if args.daemon:
+            publisher.run()
+        else:
+            publisher.publish()
+            # When starting from the snapshot file, publish the refreshed data as well
+            if not publisher.winter_credit.waitRefresh(publisher.config.http.timeouts['default'] * 2):
+                log.warning("hydro did not answer, the saved data was published")
+            publisher.publish(changes_only=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.disconnect()
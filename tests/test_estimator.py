@@ -0,0 +1,67 @@
+"""Regression tests of the winter credit estimator"""
+import datetime
+import math
+import unittest
+
+from config.config import DEFAULT_CONFIG_FILE, Config
+from hydro_api.series import ConsumptionSeries
+from winter_credit.estimator import CreditEstimator
+from winter_credit.event import Event
+
+
+class CreditEstimatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Config(DEFAULT_CONFIG_FILE)
+        self.first_day = datetime.date(2022, 1, 3)
+        # 2 kWh every hour of 30 days, the event hours use 1 kWh
+        self.event = self._event(datetime.date(2022, 1, 27))
+        self.records = []
+        for offset in range(30 * 24):
+            start = datetime.datetime.combine(self.first_day, datetime.time()) + datetime.timedelta(hours=offset)
+            kwh = 1.0 if self.event.start_ts <= start.timestamp() < self.event.end_ts else 2.0
+            self.records.append({'timestamp': start.timestamp(), 'date': start.strftime('%Y-%m-%d'),
+                                 'kwh': kwh, 'temperature': None})
+        self.now = datetime.datetime(2022, 2, 2).timestamp()
+
+    def _event(self, day):
+        return Event(self.config, day, datetime.datetime.combine(day, datetime.time(16)),
+                     datetime.datetime.combine(day, datetime.time(20)))
+
+    def testCompleteEvent(self):
+        estimate = CreditEstimator.fromEvents(self.config, [self.event], self.records).estimate(now=self.now)
+        self.assertAlmostEqual(estimate['events']['saved_kwh'][0], 4.0)
+        self.assertEqual(estimate['seasons']['2021-2022']['estimated'], 1)
+
+    def testEventWithoutData(self):
+        future = self._event(datetime.date(2022, 2, 10))
+        estimate = CreditEstimator.fromEvents(self.config, [self.event, future], self.records).estimate(now=self.now)
+        self.assertTrue(math.isnan(estimate['events']['credit'][1]))
+        self.assertTrue(math.isnan(estimate['events']['saved_kwh'][1]))
+        self.assertEqual(estimate['seasons']['2021-2022'], {
+            'events': 2, 'estimated': 1, 'saved_kwh': 4.0, 'credit': 4.0 * self.config.credit.rate_per_kwh})
+
+    def testEventWithMissingHours(self):
+        records = [record for record in self.records if record['timestamp'] != self.event.start_ts]
+        estimate = CreditEstimator.fromEvents(self.config, [self.event], records).estimate(now=self.now)
+        self.assertTrue(math.isnan(estimate['events']['credit'][0]))
+        self.assertEqual(estimate['seasons']['2021-2022']['estimated'], 0)
+
+    def testEventWithoutHourlyValues(self):
+        # Hours listed by hydro without consoTotal
+        records = [dict(record, kwh=None) if self.event.start_ts <= record['timestamp'] < self.event.end_ts
+                   else record for record in self.records]
+        for data in (records, ConsumptionSeries.fromRecords(records)):
+            estimate = CreditEstimator.fromEvents(self.config, [self.event], data).estimate(now=self.now)
+            self.assertTrue(math.isnan(estimate['events']['saved_kwh'][0]))
+            self.assertTrue(math.isnan(estimate['events']['credit'][0]))
+            self.assertEqual(estimate['seasons']['2021-2022']['estimated'], 0)
+
+    def testEventInProgress(self):
+        now = self.event.start_ts + 3600
+        estimate = CreditEstimator.fromEvents(self.config, [self.event], self.records).estimate(now=now)
+        self.assertTrue(math.isnan(estimate['events']['credit'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
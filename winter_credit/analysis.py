@@ -0,0 +1,189 @@
+"""Consumption analysis of the winter credit events"""
+import datetime
+
+import numpy as np
+
+from hydro_api.series import ConsumptionSeries
+
+# Number of non critical peaks of the same kind used as reference (see the lexicon)
+REFERENCE_PEAKS = 5
+
+
+class EventAnalysis:
+    """Vectorized consumption analysis of winter credit events
+
+    The hourly consumption is loaded once in sorted arrays with its cumulative sum, the energy used
+    during any window is then two binary searches and a subtraction. Hours without consumption value
+    (None or NaN) are not counted as hours with data. Every event of the season is evaluated in the
+    same batched pass.
+
+    For each event the following values are computed:
+
+        * event_kwh: consumption during the event
+        * anchor_kwh: consumption during the anchor period of the event
+        * reference_kwh: average consumption of the last 5 non critical peaks of the same time of day
+          and same day type (week day or weekend)
+        * reference_anchor_kwh: average consumption of the anchor periods of these reference peaks
+        * baseline_kwh: reference_kwh adjusted with the anchor period, i.e. the average power difference
+          between the event anchor and the reference anchors applied over the event duration
+
+    Peaks or anchors with missing hourly data are not used as reference. The baseline is an estimate,
+    HQ holiday exclusions are not taken into account.
+
+    :param: config: Config object
+    :param: event_starts: events start unix timestamps
+    :param: event_ends: events end unix timestamps
+    :param: timestamps: hourly consumption unix timestamps (start of the hour)
+    :param: kwh: hourly consumption values
+    """
+
+    def __init__(self, config, event_starts, event_ends, timestamps, kwh):
+        self.config = config
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        self.timestamps = timestamps[order]
+        kwh = np.asarray(kwh, dtype=np.float64)[order]
+        known = np.isfinite(kwh)
+        self.cumulative_kwh = np.concatenate(([0.0], np.cumsum(np.where(known, kwh, 0.0))))
+        self.cumulative_hours = np.concatenate(([0], np.cumsum(known)))
+        self.event_starts = np.asarray(event_starts, dtype=np.float64)
+        self.event_ends = np.asarray(event_ends, dtype=np.float64)
+        self.anchor_offset = config.periods.anchor_start_offset * 3600
+        self.anchor_duration = config.periods.anchor_duration * 3600
+
+    @classmethod
+    def fromEvents(cls, config, events, records):
+        """Build the analysis from Event objects and consumption records
+
+        :param: config: Config object
+        :param: events: Event objects, like WinterCredit.getAllEvents()
+        :param: records: hourly records, see :mod:`hydro_api.consumption`, or a
+            :class:`hydro_api.series.ConsumptionSeries`
+
+        :rtype: EventAnalysis
+        """
+        if isinstance(records, ConsumptionSeries):
+            columns = records.to_numpy()
+            return cls(
+                config,
+                [event.start_ts for event in events],
+                [event.end_ts for event in events],
+                columns['timestamps'],
+                columns['kwh']
+            )
+        return cls(
+            config,
+            [event.start_ts for event in events],
+            [event.end_ts for event in events],
+            [record['timestamp'] for record in records],
+            [np.nan if record['kwh'] is None else record['kwh'] for record in records]
+        )
+
+    def windowKwh(self, starts, ends):
+        """Consumption of many [start, end) windows at once
+
+        :param: starts: windows start timestamps
+        :param: ends: windows end timestamps
+
+        :return: (kwh, number of hours with data) arrays
+
+        :rtype: tuple
+        """
+        first = np.searchsorted(self.timestamps, starts, side='left')
+        last = np.searchsorted(self.timestamps, ends, side='left')
+        return (self.cumulative_kwh[last] - self.cumulative_kwh[first],
+                self.cumulative_hours[last] - self.cumulative_hours[first])
+
+    def _peakPeriods(self):
+        """Every peak period of the days covered by the consumption data
+
+        :return: (starts, ends, morning flags, weekend flags) arrays
+
+        :rtype: tuple
+        """
+        if not self.timestamps.size:
+            return np.empty(0), np.empty(0), np.empty(0, dtype=bool), np.empty(0, dtype=bool)
+        periods = self.config.periods
+        times = [
+            (True, datetime.time.fromisoformat(periods.morning_peak_start),
+             datetime.time.fromisoformat(periods.morning_peak_end)),
+            (False, datetime.time.fromisoformat(periods.evening_peak_start),
+             datetime.time.fromisoformat(periods.evening_peak_end)),
+        ]
+        first_day = datetime.date.fromtimestamp(self.timestamps[0])
+        last_day = datetime.date.fromtimestamp(self.timestamps[-1])
+        rows = []
+        for offset in range((last_day - first_day).days + 1):
+            day = first_day + datetime.timedelta(days=offset)
+            for morning, start, end in times:
+                rows.append((
+                    datetime.datetime.combine(day, start).timestamp(),
+                    datetime.datetime.combine(day, end).timestamp(),
+                    morning,
+                    day.weekday() >= 5
+                ))
+        starts, ends, morning, weekend = zip(*rows)
+        return np.array(starts), np.array(ends), np.array(morning), np.array(weekend)
+
+    def analyze(self):
+        """Compute the consumption values of every event
+
+        :return: arrays indexed like the events: start_ts, end_ts, event_kwh, event_hours, anchor_kwh,
+                 anchor_hours, reference_kwh, reference_anchor_kwh, reference_count, baseline_kwh.
+                 Reference values are NaN when no reference peak is available.
+
+        :rtype: dict
+        """
+        starts = self.event_starts
+        ends = self.event_ends
+        event_kwh, event_hours = self.windowKwh(starts, ends)
+        anchor_starts = starts - self.anchor_offset
+        anchor_kwh, anchor_hours = self.windowKwh(anchor_starts, anchor_starts + self.anchor_duration)
+
+        peak_starts, peak_ends, peak_morning, peak_weekend = self._peakPeriods()
+        peak_kwh, peak_hours = self.windowKwh(peak_starts, peak_ends)
+        peak_anchor_starts = peak_starts - self.anchor_offset
+        peak_anchor_kwh, peak_anchor_hours = self.windowKwh(peak_anchor_starts,
+                                                            peak_anchor_starts + self.anchor_duration)
+        usable = (~np.isin(peak_starts, starts)
+                  & (peak_hours == np.round((peak_ends - peak_starts) / 3600))
+                  & (peak_anchor_hours == round(self.anchor_duration / 3600)))
+
+        event_days = [datetime.datetime.fromtimestamp(start) for start in starts]
+        event_morning = np.array([day.hour < 12 for day in event_days], dtype=bool)
+        event_weekend = np.array([day.weekday() >= 5 for day in event_days], dtype=bool)
+
+        reference_kwh = np.full(starts.shape, np.nan)
+        reference_anchor_kwh = np.full(starts.shape, np.nan)
+        reference_count = np.zeros(starts.shape, dtype=np.int64)
+        for morning in (True, False):
+            for weekend in (False, True):
+                members = (event_morning == morning) & (event_weekend == weekend)
+                if not members.any():
+                    continue
+                group = usable & (peak_morning == morning) & (peak_weekend == weekend)
+                group_starts = peak_starts[group]
+                group_kwh = np.concatenate(([0.0], np.cumsum(peak_kwh[group])))
+                group_anchor_kwh = np.concatenate(([0.0], np.cumsum(peak_anchor_kwh[group])))
+                last = np.searchsorted(group_starts, starts[members], side='left')
+                first = np.maximum(last - REFERENCE_PEAKS, 0)
+                count = last - first
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    reference_kwh[members] = (group_kwh[last] - group_kwh[first]) / count
+                    reference_anchor_kwh[members] = (group_anchor_kwh[last] - group_anchor_kwh[first]) / count
+                reference_count[members] = count
+
+        baseline_kwh = reference_kwh + (anchor_kwh - reference_anchor_kwh) * (ends - starts) / self.anchor_duration
+
+        return {
+            'start_ts': starts,
+            'end_ts': ends,
+            'event_kwh': event_kwh,
+            'event_hours': event_hours,
+            'anchor_kwh': anchor_kwh,
+            'anchor_hours': anchor_hours,
+            'reference_kwh': reference_kwh,
+            'reference_anchor_kwh': reference_anchor_kwh,
+            'reference_count': reference_count,
+            'baseline_kwh': baseline_kwh
+        }
@@ -0,0 +1,102 @@
+"""Winter credit earnings estimation"""
+import time
+
+import numpy as np
+
+from .analysis import EventAnalysis
+
+
+class CreditEstimator:
+    """Estimate the credit earned by each winter credit event
+
+    The credit of an event is the energy saved compared to the anchor adjusted baseline
+    (see :class:`winter_credit.analysis.EventAnalysis`) multiplied by ``credit.rate_per_kwh``.
+    Consuming more than the baseline does not cost anything, the credit is then 0.
+
+    Everything is computed on the analysis arrays, a multi-season history is recomputed in one pass.
+
+    :param: analysis: EventAnalysis of the events to estimate
+    """
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.config = analysis.config
+
+    @classmethod
+    def fromEvents(cls, config, events, records):
+        """Build the estimator from Event objects and consumption records
+
+        :param: config: Config object
+        :param: events: Event objects of any number of winters
+        :param: records: hourly records, see :mod:`hydro_api.consumption`, or a ConsumptionSeries
+
+        :rtype: CreditEstimator
+        """
+        return cls(EventAnalysis.fromEvents(config, events, records))
+
+    @staticmethod
+    def seasonOf(timestamps):
+        """Return the winter of each timestamp, identified by the year it starts in
+
+        :param: timestamps: unix timestamps
+
+        :rtype: numpy.ndarray
+        """
+        months = np.asarray(timestamps, dtype=np.float64).astype('datetime64[s]').astype('datetime64[M]')
+        years = months.astype('datetime64[Y]').astype(np.int64) + 1970
+        # Winters span over two years, events before July belong to the winter started the previous year
+        return years - (months.astype(np.int64) % 12 < 6)
+
+    def estimate(self, now=None):
+        """Compute the credit of every event, season and the current season to date
+
+        :param: now: reference timestamp for the season to date, defaults to the current time
+
+        :return:
+
+            ::
+
+                {
+                    'events': {... analysis arrays ..., 'season': [...], 'saved_kwh': [...], 'credit': [...]},
+                    'seasons': {'2021-2022': {'events': 2, 'estimated': 2, 'saved_kwh': 1.5, 'credit': 0.75}},
+                    'season_to_date': {... same values for the past events of the current season ...}
+                }
+
+            Events without reference data, with missing hours in the event or its anchor period, or not
+            ended at now have a NaN credit and are not counted as estimated.
+
+        :rtype: dict
+        """
+        if now is None:
+            now = time.time()
+        events = self.analysis.analyze()
+        saved_kwh = np.maximum(events['baseline_kwh'] - events['event_kwh'], 0.0)
+        # An event is only estimated once it ended and all its hours and anchor hours are known
+        complete = ((events['event_hours'] >= np.round((events['end_ts'] - events['start_ts']) / 3600))
+                    & (events['anchor_hours'] >= round(self.analysis.anchor_duration / 3600))
+                    & (events['end_ts'] <= now))
+        saved_kwh = np.where(complete, saved_kwh, np.nan)
+        credit = saved_kwh * self.config.credit.rate_per_kwh
+        seasons = self.seasonOf(events['start_ts'])
+        events['season'] = seasons
+        events['saved_kwh'] = saved_kwh
+        events['credit'] = credit
+
+        summary = {}
+        for season in np.unique(seasons):
+            summary['%d-%d' % (season, season + 1)] = self._summarize(credit, saved_kwh, seasons == season)
+
+        current_season = self.seasonOf([now])[0]
+        season_to_date = self._summarize(credit, saved_kwh, (seasons == current_season) & (events['end_ts'] <= now))
+
+        return {'events': events, 'seasons': summary, 'season_to_date': season_to_date}
+
+    @staticmethod
+    def _summarize(credit, saved_kwh, mask):
+        estimated = mask & ~np.isnan(credit)
+        return {
+            'events': int(mask.sum()),
+            'estimated': int(estimated.sum()),
+            'saved_kwh': float(saved_kwh[estimated].sum()),
+            'credit': float(credit[estimated].sum())
+        }
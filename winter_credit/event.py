@@ -1,49 +1,149 @@
 """Class describing an event"""
+import datetime
+from array import array
+
+# Marks a missing pre-heat in EventTable columns
+NO_PRE_HEAT = -1
+
 
 class Event:
-    """This class describe an event object"""
+    """This class describe an event object
+
+    Only epoch seconds are stored, the string values are formatted when accessed and the to_dict()
+    result is cached. The cached dict is shared, it must not be modified.
+    """
+
+    __slots__ = ('datetime_format', 'day', 'start_ts', 'end_ts', 'pre_heat_start_ts', 'pre_heat_end_ts', '_dict')
 
     def __init__(self, config, date, start, end):
-        self.config = config
-        self.date_dt = date
-        self.start_dt = start
-        self.end_dt = end
-        self.date = date.strftime('%Y-%m-%d')
-        self.start = start.strftime(self.config.formats.datetime_format)
-        self.end = end.strftime(self.config.formats.datetime_format)
-        self.start_ts = self.start_dt.timestamp()
-        self.end_ts = self.end_dt.timestamp()
-        self.pre_heat_start = None
-        self.pre_heat_end = None
+        self.datetime_format = config.formats.datetime_format
+        self.day = date.toordinal()
+        self.start_ts = int(start.timestamp())
+        self.end_ts = int(end.timestamp())
         self.pre_heat_start_ts = None
         self.pre_heat_end_ts = None
+        self._dict = None
+
+    @property
+    def date_dt(self):
+        return datetime.datetime.combine(datetime.date.fromordinal(self.day), datetime.time())
+
+    @property
+    def start_dt(self):
+        return datetime.datetime.fromtimestamp(self.start_ts)
+
+    @property
+    def end_dt(self):
+        return datetime.datetime.fromtimestamp(self.end_ts)
+
+    @property
+    def date(self):
+        return datetime.date.fromordinal(self.day).strftime('%Y-%m-%d')
+
+    @property
+    def start(self):
+        return self.start_dt.strftime(self.datetime_format)
+
+    @property
+    def end(self):
+        return self.end_dt.strftime(self.datetime_format)
+
+    @property
+    def pre_heat_start(self):
+        if self.pre_heat_start_ts is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.pre_heat_start_ts).strftime(self.datetime_format)
+
+    @property
+    def pre_heat_end(self):
+        if self.pre_heat_end_ts is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.pre_heat_end_ts).strftime(self.datetime_format)
 
     def to_dict(self):
-        if self.pre_heat_start:
-            return {
+        if self._dict is None:
+            self._dict = {
                 'date': self.date,
                 'start': self.start,
                 'end': self.end,
-                'start_ts': self.start_ts,
-                'end_ts': self.end_ts,
-                'pre_heat_start': self.pre_heat_start,
-                'pre_heat_end': self.pre_heat_end,
-                'pre_heat_start_ts': self.pre_heat_start_ts,
-                'pre_heat_end_ts': self.pre_heat_end_ts
+                'start_ts': float(self.start_ts),
+                'end_ts': float(self.end_ts),
             }
+            if self.pre_heat_start_ts is not None:
+                self._dict.update({
+                    'pre_heat_start': self.pre_heat_start,
+                    'pre_heat_end': self.pre_heat_end,
+                    'pre_heat_start_ts': float(self.pre_heat_start_ts),
+                    'pre_heat_end_ts': float(self.pre_heat_end_ts)
+                })
+        return self._dict
+
+    def addPreheat(self, start_ts, end_ts):
+        self.pre_heat_start_ts = int(start_ts)
+        self.pre_heat_end_ts = int(end_ts)
+        self._dict = None
+
+
+class EventTable:
+    """Columnar storage of many events
+
+    Each column is a typed array of epoch seconds, a missing pre-heat is stored as NO_PRE_HEAT.
+    The columns support the buffer protocol and can be used as NumPy arrays without copy,
+    ex: ``numpy.frombuffer(table.starts, dtype=numpy.int64)``.
+
+    :param: config: Config object
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.days = array('q')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.pre_heat_starts = array('q')
+        self.pre_heat_ends = array('q')
+
+    @classmethod
+    def fromEvents(cls, config, events):
+        """Build a table from Event objects
+
+        :rtype: EventTable
+        """
+        table = cls(config)
+        for event in events:
+            table.append(event)
+        return table
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, event):
+        self.days.append(event.day)
+        self.starts.append(event.start_ts)
+        self.ends.append(event.end_ts)
+        if event.pre_heat_start_ts is None:
+            self.pre_heat_starts.append(NO_PRE_HEAT)
+            self.pre_heat_ends.append(NO_PRE_HEAT)
         else:
-            return {
-                'date': self.date,
-                'start': self.start,
-                'end': self.end,
-                'start_ts': self.start_ts,
-                'end_ts': self.end_ts,
-            }
+            self.pre_heat_starts.append(event.pre_heat_start_ts)
+            self.pre_heat_ends.append(event.pre_heat_end_ts)
 
+    def __getitem__(self, index):
+        """Return an Event object for a row"""
+        event = Event.__new__(Event)
+        event.datetime_format = self.config.formats.datetime_format
+        event.day = self.days[index]
+        event.start_ts = self.starts[index]
+        event.end_ts = self.ends[index]
+        event.pre_heat_start_ts = None
+        event.pre_heat_end_ts = None
+        event._dict = None
+        if self.pre_heat_starts[index] != NO_PRE_HEAT:
+            event.addPreheat(self.pre_heat_starts[index], self.pre_heat_ends[index])
+        return event
 
-    def addPreheat(self,start, end, start_ts, end_ts):
-        self.pre_heat_start = start
-        self.pre_heat_end = end
-        self.pre_heat_start_ts = start_ts
-        self.pre_heat_end_ts = end_ts
+    def to_dicts(self):
+        """Return the to_dict() of every event
 
+        :rtype: list
+        """
+        return [self[index].to_dict() for index in range(len(self))]
@@ -0,0 +1,263 @@
+"""HTTP gateway serving the winter credit state of several contracts"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from aiohttp import web
+
+from config.config import get_config
+from hydro_api.metrics import metrics
+from .event import Event
+from .winter_credit import WinterCredit
+
+log = logging.getLogger(__name__)
+
+# Documents served for each contract, also the names of the server-sent events
+DOCUMENTS = ('state', 'next', 'future_events')
+
+
+def _serialize(value):
+    body = json.dumps(value, separators=(',', ':')).encode()
+    return body, '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+class StateGateway:
+    """
+    Local HTTP server sharing one WinterCredit per contract with many clients
+
+    The state of every contract is evaluated every gateway.interval seconds in a worker thread and kept
+    as serialized JSON, requests are answered from memory without calling hydro. A document is only
+    serialized again when its content changes, its ETag changes at the same time and a client sending
+    If-None-Match gets a 304. last_update is the time of the evaluation that changed the document.
+
+    The WinterCredit objects refresh their data in the background, a hydro outage does not delay the
+    responses (see :class:`winter_credit.winter_credit.WinterCredit`) and an expired session is logged in
+    again by the next refresh. The accounts that could not be loaded are tried again after
+    periods.refresh_retry_seconds, doubled after each failure up to periods.event_refresh_seconds.
+
+    Routes:
+
+        * GET /contracts: served contract ids
+        * GET /{contract_id}/state: :meth:`WinterCredit.getCurrentState`
+        * GET /{contract_id}/next: :meth:`WinterCredit.getNextEvent`, {} when there is none
+        * GET /{contract_id}/future_events: :meth:`WinterCredit.getFutureEvents`
+        * GET /{contract_id}/events: server-sent events stream, the current documents are sent on connection
+          then each changed document is sent as an event named state, next or future_events
+        * GET /metrics: :mod:`hydro_api.metrics` in the Prometheus format
+
+    :param: accounts: list of {'user': ..., 'password': ...}, defaults to fleet.accounts or the config credentials
+    :param: host: listening address, defaults to gateway.host
+    :param: port: listening port, defaults to gateway.port
+
+    :example:
+
+        ::
+
+            gateway = StateGateway()
+            asyncio.run(gateway.run())
+    """
+
+    def __init__(self, accounts=None, host=None, port=None):
+        self.config = get_config()
+        if accounts is None:
+            accounts = self.config.fleet.accounts or [{
+                'user': self.config.credentials.user,
+                'password': self.config.credentials.password
+            }]
+        self.accounts = accounts
+        self.host = host or self.config.gateway.host
+        self.port = port if port is not None else self.config.gateway.port
+        self.winter_credits = {}
+        # index of the accounts not loaded yet -> (failures, time of the next attempt)
+        self.pending_accounts = {}
+        self.load_task = None
+        # contract id -> document name -> (body, etag, value)
+        self.documents = {}
+        # contract id -> set of the queues of the connected event streams
+        self.subscribers = {}
+        self.runner = None
+        self.update_task = None
+
+    def _createWinterCredit(self, account):
+        return WinterCredit(background_refresh=True, user=account['user'], password=account['password'])
+
+    async def _loadAccounts(self, indexes):
+        """Create the WinterCredit objects of accounts, the failed ones are tried again later"""
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(None, self._createWinterCredit, self.accounts[index])
+                                         for index in indexes], return_exceptions=True)
+        for index, result in zip(indexes, results):
+            if isinstance(result, Exception):
+                failures = self.pending_accounts.get(index, (0, 0))[0] + 1
+                delay = min(self.config.periods.refresh_retry_seconds * 2 ** (failures - 1),
+                            self.config.periods.event_refresh_seconds)
+                log.error('unable to load the winter credit of %s: %s, trying again in %ss'
+                          % (self.accounts[index]['user'], result, delay))
+                self.pending_accounts[index] = (failures, time.time() + delay)
+                continue
+            self.pending_accounts.pop(index, None)
+            self.winter_credits[str(result.contract_id)] = result
+
+    def _retryAccounts(self):
+        """Load the failed accounts due for a new attempt in the background"""
+        if self.load_task is not None and not self.load_task.done():
+            return
+        now = time.time()
+        indexes = [index for index, (_, retry_at) in self.pending_accounts.items() if retry_at <= now]
+        if indexes:
+            self.load_task = asyncio.create_task(self._loadAccounts(indexes))
+
+    def _evaluate(self, winter_credit):
+        """Current documents of a contract, called in a worker thread
+
+        :rtype: dict
+        """
+        next_event = winter_credit.getNextEvent()
+        return {
+            'state': winter_credit.getCurrentState(),
+            'next': next_event.to_dict() if isinstance(next_event, Event) else {},
+            'future_events': winter_credit.getFutureEvents()
+        }
+
+    def _publish(self, contract_id, values):
+        """Serialize the changed documents and send them to the event streams"""
+        documents = self.documents.setdefault(contract_id, {})
+        for name, value in values.items():
+            current = documents.get(name)
+            if current is not None:
+                compared = value
+                if name == 'state':
+                    # A change of the evaluation time alone is not a change of the document
+                    compared = dict(value, last_update=current[2]['last_update'])
+                if compared == current[2]:
+                    continue
+            body, etag = _serialize(value)
+            documents[name] = (body, etag, value)
+            if current is None:
+                continue
+            log.debug('%s %s changed' % (contract_id, name))
+            message = b'event: %s\ndata: %s\n\n' % (name.encode(), body)
+            for queue in list(self.subscribers.get(contract_id, ())):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # The client does not read its stream, it will reconnect and get the current documents
+                    log.warning('closing a slow event stream of %s' % contract_id)
+                    self.subscribers[contract_id].discard(queue)
+                    self._close(queue)
+
+    def _close(self, queue):
+        """End an event stream"""
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _evaluateAll(self):
+        loop = asyncio.get_running_loop()
+        contracts = list(self.winter_credits.items())
+        results = await asyncio.gather(*[loop.run_in_executor(None, self._evaluate, winter_credit)
+                                         for _, winter_credit in contracts], return_exceptions=True)
+        for (contract_id, _), result in zip(contracts, results):
+            if isinstance(result, Exception):
+                log.error('unable to evaluate the state of %s: %s' % (contract_id, result))
+                metrics.increment('gateway_evaluations_total', result='error')
+                continue
+            metrics.increment('gateway_evaluations_total', result='success')
+            self._publish(contract_id, result)
+
+    async def _updateLoop(self):
+        while True:
+            await asyncio.sleep(self.config.gateway.interval)
+            try:
+                self._retryAccounts()
+                await self._evaluateAll()
+            except Exception:
+                log.exception('state update failed')
+
+    async def start(self):
+        """Create the WinterCredit objects, evaluate the states and start listening"""
+        await self._loadAccounts(list(range(len(self.accounts))))
+        if not self.winter_credits:
+            raise RuntimeError('no contract could be loaded')
+        await self._evaluateAll()
+        self.update_task = asyncio.create_task(self._updateLoop())
+
+        app = web.Application()
+        app.router.add_get('/contracts', self._contracts)
+        app.router.add_get('/metrics', self._metrics)
+        app.router.add_get('/{contract_id}/events', self._events)
+        app.router.add_get('/{contract_id}/{document}', self._document)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        log.info('serving %s contracts on http://%s:%s' % (len(self.winter_credits), self.host, self.port))
+
+    async def stop(self):
+        if self.update_task is not None:
+            self.update_task.cancel()
+            self.update_task = None
+        if self.load_task is not None:
+            self.load_task.cancel()
+            self.load_task = None
+        for queues in self.subscribers.values():
+            for queue in queues:
+                self._close(queue)
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def run(self):
+        """Serve until cancelled"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    async def _contracts(self, request):
+        return web.json_response(sorted(self.documents))
+
+    async def _metrics(self, request):
+        return web.Response(text=metrics.toPrometheus(), content_type='text/plain')
+
+    async def _document(self, request):
+        name = request.match_info['document']
+        documents = self.documents.get(request.match_info['contract_id'])
+        if documents is None or name not in DOCUMENTS:
+            raise web.HTTPNotFound()
+        body, etag, _ = documents[name]
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in request.headers.get('If-None-Match', ''):
+            metrics.increment('gateway_requests_total', document=name, status='304')
+            return web.Response(status=304, headers=headers)
+        metrics.increment('gateway_requests_total', document=name, status='200')
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    async def _events(self, request):
+        contract_id = request.match_info['contract_id']
+        documents = self.documents.get(contract_id)
+        if documents is None:
+            raise web.HTTPNotFound()
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        queue = asyncio.Queue(maxsize=64)
+        self.subscribers.setdefault(contract_id, set()).add(queue)
+        metrics.increment('gateway_streams_total')
+        try:
+            for name in DOCUMENTS:
+                await response.write(b'event: %s\ndata: %s\n\n' % (name.encode(), documents[name][0]))
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.config.gateway.keepalive)
+                except asyncio.TimeoutError:
+                    message = b': keepalive\n\n'
+                if message is None:
+                    break
+                await response.write(message)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.subscribers[contract_id].discard(queue)
+        return response
@@ -0,0 +1,65 @@
+"""Sorted interval index"""
+import datetime
+from bisect import bisect_left, bisect_right
+
+
+class IntervalIndex:
+    """Index of time intervals sorted by start time
+
+    Point in time queries are binary searches on the sorted start times. Intervals of an index are expected
+    not to overlap, which is the case for the events and for each kind of period.
+    Like everywhere else in winter_credit, an interval includes both its start and its end.
+
+    :param: intervals: iterable of (start_ts, end_ts, item)
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.items = [interval[2] for interval in intervals]
+
+    @classmethod
+    def fromObjects(cls, objects):
+        """Build an index of objects having start_ts and end_ts attributes (Event, Period)
+
+        :rtype: IntervalIndex
+        """
+        return cls((obj.start_ts, obj.end_ts, obj) for obj in objects)
+
+    def __len__(self):
+        return len(self.items)
+
+    def activeAt(self, ts):
+        """Return the item active at ts or None"""
+        position = bisect_right(self.starts, ts) - 1
+        if position >= 0 and self.ends[position] >= ts:
+            return self.items[position]
+        return None
+
+    def nextAfter(self, ts):
+        """Return the first item starting after ts or None"""
+        position = bisect_right(self.starts, ts)
+        if position < len(self.items):
+            return self.items[position]
+        return None
+
+    def between(self, start_ts, end_ts):
+        """Return the items starting in [start_ts, end_ts)
+
+        :rtype: list
+        """
+        return self.items[bisect_left(self.starts, start_ts):bisect_left(self.starts, end_ts)]
+
+    def onDate(self, date):
+        """Return the items starting on a day
+
+        :param: date: datetime.date or YYYY-MM-DD string
+
+        :rtype: list
+        """
+        if isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+        start = datetime.datetime.combine(date, datetime.time())
+        end = start + datetime.timedelta(days=1)
+        return self.between(start.timestamp(), end.timestamp())
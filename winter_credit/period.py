@@ -1,26 +1,56 @@
 """Class describing a period"""
+import datetime
+
 
 class Period:
-    """This class describe a period object"""
+    """This class describe a period object
+
+    Only epoch seconds are stored, the string values are formatted when accessed and the to_dict()
+    result is cached. The cached dict is shared, it must not be modified.
+    """
+
+    __slots__ = ('datetime_format', 'day', 'start_ts', 'end_ts', 'critical', '_dict')
 
     def __init__(self, config, date, start, end, critical = False):
-        self.config = config
-        self.date_dt = date
-        self.start_dt = start
-        self.end_dt = end
+        self.datetime_format = config.formats.datetime_format
+        self.day = date.toordinal()
+        self.start_ts = int(start.timestamp())
+        self.end_ts = int(end.timestamp())
         self.critical = critical
-        self.date = date.strftime('%Y-%m-%d')
-        self.start = start.strftime(self.config.formats.datetime_format)
-        self.end = end.strftime(self.config.formats.datetime_format)
-        self.start_ts = self.start_dt.timestamp()
-        self.end_ts = self.end_dt.timestamp()
+        self._dict = None
+
+    @property
+    def date_dt(self):
+        return datetime.datetime.combine(datetime.date.fromordinal(self.day), datetime.time())
+
+    @property
+    def start_dt(self):
+        return datetime.datetime.fromtimestamp(self.start_ts)
+
+    @property
+    def end_dt(self):
+        return datetime.datetime.fromtimestamp(self.end_ts)
+
+    @property
+    def date(self):
+        return datetime.date.fromordinal(self.day).strftime('%Y-%m-%d')
+
+    @property
+    def start(self):
+        return self.start_dt.strftime(self.datetime_format)
+
+    @property
+    def end(self):
+        return self.end_dt.strftime(self.datetime_format)
 
     def to_dict(self):
-       return {
-            'date': self.date,
-            'start': self.start,
-            'end': self.end,
-            'start_ts': self.start_ts,
-            'end_ts': self.end_ts,
-            'critical': self.critical
-       }
+        if self._dict is None:
+            self._dict = {
+                'date': self.date,
+                'start': self.start,
+                'end': self.end,
+                'start_ts': float(self.start_ts),
+                'end_ts': float(self.end_ts),
+                'critical': self.critical
+            }
+        return self._dict
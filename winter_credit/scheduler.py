@@ -0,0 +1,83 @@
+"""Winter credit state scheduler"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Periods include their end time, the state only changes right after a boundary
+TRANSITION_DELAY = 1
+
+
+class StateScheduler:
+    """Call back with the new state each time it changes
+
+    Instead of polling, the scheduler sleeps until the next transition returned by
+    :meth:`winter_credit.winter_credit.WinterCredit.getNextTransition` (or the next data refresh if it
+    comes first) and only calls back when the state is different from the previous one.
+
+    :param: winter_credit: WinterCredit object
+    :param: callback: called with the getCurrentState() result
+
+    :example:
+
+        ::
+
+            scheduler = StateScheduler(WinterCredit(), print)
+            threading.Thread(target=scheduler.run).start()
+            ...
+            scheduler.stop()
+    """
+
+    def __init__(self, winter_credit, callback):
+        self.winter_credit = winter_credit
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.last_state = None
+
+    def _stateChanged(self, state):
+        # last_update is the evaluation time, it changes every time
+        comparable = {key: value for key, value in state.items() if key != 'last_update'}
+        if comparable == self.last_state:
+            return False
+        self.last_state = comparable
+        return True
+
+    def nextWakeUp(self):
+        """Return the time the state needs to be evaluated again
+
+        A refresh due in the past is running in the background (or waits for a failed one to be retried),
+        the state is evaluated again periods.refresh_retry_seconds later.
+
+        :rtype: float
+        """
+        now = time.time()
+        next_refresh = self.winter_credit.nextRefresh()
+        if next_refresh <= now:
+            next_refresh = now + self.winter_credit.config.periods.refresh_retry_seconds
+        return min(self.winter_credit.getNextTransition() + TRANSITION_DELAY, next_refresh + TRANSITION_DELAY)
+
+    def runOnce(self):
+        """Evaluate the state, call back if it changed
+
+        :return: time of the next evaluation
+
+        :rtype: float
+        """
+        state = self.winter_credit.getCurrentState()
+        if self._stateChanged(state):
+            self.callback(state)
+        return self.nextWakeUp()
+
+    def run(self):
+        """Evaluate the state at each transition until stop() is called"""
+        while not self.stopped.is_set():
+            try:
+                wake_up = self.runOnce()
+            except Exception:
+                log.exception('unable to evaluate the state')
+                wake_up = time.time() + self.winter_credit.config.periods.event_refresh_seconds
+            self.stopped.wait(max(0, wake_up - time.time()))
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,89 @@
+"""Winter credit data snapshot"""
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+# Version of the snapshot files, files of another version are ignored
+FILE_VERSION = 1
+
+
+class Snapshot:
+    """Result of one winter credit data refresh
+
+    A snapshot is completely built before being published and is not modified afterward, a reader keeping
+    a reference has a consistent view of the data while a newer snapshot replaces it.
+    Only the state timeline is calculated lazily, on first use.
+
+    :param: data: getWinterCredit() response, None for a snapshot loaded from a file
+    :param: events: events object, see :meth:`winter_credit.winter_credit.WinterCredit._getWinterCreditEvents`
+    :param: event_index: IntervalIndex of the current winter events
+    :param: event_in_progress: True if an event was in progress when the data was refreshed
+    :param: last_update: unix timestamp of the refresh
+    :param: contract_id: hydro contract of the data
+    """
+
+    __slots__ = ('data', 'events', 'event_index', 'event_in_progress', 'last_update', 'contract_id', 'timeline')
+
+    def __init__(self, data, events, event_index, event_in_progress, last_update, contract_id=None):
+        self.data = data
+        self.events = events
+        self.event_index = event_index
+        self.event_in_progress = event_in_progress
+        self.last_update = last_update
+        self.contract_id = contract_id
+        self.timeline = None
+
+    def to_dict(self):
+        """Compact form of the events, one [day ordinal, start_ts, end_ts] row per event
+
+        :rtype: dict
+        """
+        current_winter = self.events['current_winter']
+        return {
+            'version': FILE_VERSION,
+            'last_update': self.last_update,
+            'contract_id': self.contract_id,
+            'current_winter': [[event.day, event.start_ts, event.end_ts] for event in
+                               list(current_winter['past'].values()) + list(current_winter['future'].values())],
+            'past_winters': [[event.day, event.start_ts, event.end_ts] for event in
+                             self.events['past_winters'].values()]
+        }
+
+    def save(self, path, user=None):
+        """Write the snapshot to a file, the file is replaced atomically
+
+        :param: path: snapshot file
+        :param: user: hydro account of the data, a file saved for another account is not loaded
+        """
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(self.to_dict(), user=user), f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError:
+            log.error('unable to write snapshot %s' % path)
+
+
+def load(path):
+    """Read a snapshot file written by :meth:`Snapshot.save`
+
+    :param: path: snapshot file
+
+    :return: the to_dict() content or None if there is no usable snapshot
+
+    :rtype: dict
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        log.warning('unable to read snapshot %s' % path)
+        return None
+    if not isinstance(data, dict) or data.get('version') != FILE_VERSION:
+        log.warning('ignoring snapshot %s, unknown version' % path)
+        return None
+    return data
@@ -0,0 +1,140 @@
+"""Vectorized winter credit state evaluation"""
+import datetime
+
+import numpy as np
+
+TIMES_OF_DAY = np.array(['normal', 'peak_morning', 'peak_evening', 'anchor_morning', 'anchor_evening'])
+PERIODS = np.array(['normal', 'peak', 'peak', 'anchor', 'anchor'])
+
+
+class StateTimeline:
+    """Evaluate the winter credit state at many timestamps at once
+
+    Gives the same values as the 'state' part of
+    :meth:`winter_credit.winter_credit.WinterCredit.getCurrentState` for any timestamp, using the periods
+    defined in the config and the given events. Day boundaries are calculated once per day covered by the
+    timestamps, everything else is done with NumPy on the whole array.
+
+    :param: config: Config object
+    :param: event_starts: events start unix timestamps
+    :param: event_ends: events end unix timestamps
+    """
+
+    def __init__(self, config, event_starts, event_ends):
+        self.config = config
+        order = np.argsort(np.asarray(event_starts, dtype=np.float64), kind='stable')
+        self.event_starts = np.asarray(event_starts, dtype=np.float64)[order]
+        self.event_ends = np.asarray(event_ends, dtype=np.float64)[order]
+
+    def _days(self, first_day, count):
+        """Boundaries of count days starting at first_day
+
+        :rtype: dict
+        """
+        periods = self.config.periods
+        anchor_offset = datetime.timedelta(hours=periods.anchor_start_offset)
+        anchor_duration = datetime.timedelta(hours=periods.anchor_duration)
+        times = {
+            'morning_peak_start': datetime.time.fromisoformat(periods.morning_peak_start),
+            'morning_peak_end': datetime.time.fromisoformat(periods.morning_peak_end),
+            'evening_peak_start': datetime.time.fromisoformat(periods.evening_peak_start),
+            'evening_peak_end': datetime.time.fromisoformat(periods.evening_peak_end),
+            'noon': datetime.time(12),
+            'midnight': datetime.time(),
+        }
+        days = {key: [] for key in list(times) + ['morning_anchor_start', 'morning_anchor_end',
+                                                  'evening_anchor_start', 'evening_anchor_end']}
+        for offset in range(count):
+            day = first_day + datetime.timedelta(days=offset)
+            for key, day_time in times.items():
+                days[key].append(datetime.datetime.combine(day, day_time).timestamp())
+            for peak in ('morning', 'evening'):
+                anchor_start = datetime.datetime.combine(day, times[peak + '_peak_start']) - anchor_offset
+                days[peak + '_anchor_start'].append(anchor_start.timestamp())
+                days[peak + '_anchor_end'].append((anchor_start + anchor_duration).timestamp())
+        return {key: np.array(values) for key, values in days.items()}
+
+    def _activeEvent(self, timestamps):
+        """Index of the event active at each timestamp, -1 if none"""
+        position = np.searchsorted(self.event_starts, timestamps, side='right') - 1
+        active = position >= 0
+        active[active] &= self.event_ends[position[active]] >= timestamps[active]
+        return np.where(active, position, -1)
+
+    def _hasEvent(self, start, end):
+        """True for each [start, end) window containing an event start"""
+        return np.searchsorted(self.event_starts, end, side='left') > \
+            np.searchsorted(self.event_starts, start, side='left')
+
+    def evaluate(self, timestamps):
+        """Evaluate the state at each timestamp
+
+        :param: timestamps: unix timestamps
+
+        :return: arrays indexed like timestamps, with the keys of getCurrentState()['state']
+
+        :rtype: dict
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if not timestamps.size:
+            return {key: np.empty(0) for key in (
+                'current_period', 'current_period_time_of_day', 'current_composite_state', 'critical',
+                'event_in_progress', 'pre_heat', 'upcoming_event', 'morning_event_today', 'evening_event_today',
+                'morning_event_tomorrow', 'evening_event_tomorrow')}
+        first_day = datetime.date.fromtimestamp(timestamps.min())
+        last_day = datetime.date.fromtimestamp(timestamps.max())
+        # One extra day for the next morning peak and two for tomorrow's events
+        days = self._days(first_day, (last_day - first_day).days + 3)
+        day = np.searchsorted(days['midnight'], timestamps, side='right') - 1
+
+        def within(start, end):
+            return (days[start][day] <= timestamps) & (timestamps <= days[end][day])
+
+        time_of_day = np.zeros(timestamps.shape, dtype=np.int64)
+        # Same precedence as getCurrentState: peak first, then anchor
+        for code, (start, end) in reversed(list(enumerate((
+                ('morning_peak_start', 'morning_peak_end'),
+                ('evening_peak_start', 'evening_peak_end'),
+                ('morning_anchor_start', 'morning_anchor_end'),
+                ('evening_anchor_start', 'evening_anchor_end')), start=1))):
+            time_of_day[within(start, end)] = code
+
+        next_peak_end = np.where(
+            timestamps <= days['morning_peak_end'][day],
+            days['morning_peak_end'][day],
+            np.where(timestamps <= days['evening_peak_end'][day],
+                     days['evening_peak_end'][day],
+                     days['morning_peak_end'][day + 1])
+        )
+        critical = self._activeEvent(next_peak_end) >= 0
+
+        active_event = self._activeEvent(timestamps)
+        next_event = np.where(active_event >= 0, active_event,
+                              np.searchsorted(self.event_starts, timestamps, side='left'))
+        has_next = next_event < self.event_starts.size
+        if self.event_starts.size:
+            next_start = self.event_starts[np.minimum(next_event, self.event_starts.size - 1)]
+        else:
+            next_start = np.zeros(timestamps.shape)
+        pre_heat_start = next_start - self.config.periods.pre_heat_start_offset * 3600
+        pre_heat_end = next_start - self.config.periods.pre_heat_end_offset * 3600
+        pre_heat = has_next & (pre_heat_start <= timestamps) & (timestamps <= pre_heat_end)
+
+        morning_event = self._hasEvent(days['midnight'], days['noon'])
+        evening_event = self._hasEvent(days['noon'], days['midnight'][1:].tolist() + [np.inf])
+
+        time_of_day_names = TIMES_OF_DAY[time_of_day]
+        return {
+            'current_period': PERIODS[time_of_day],
+            'current_period_time_of_day': time_of_day_names,
+            'current_composite_state': np.char.add(time_of_day_names,
+                                                   np.where(critical, '_critical', '_normal')),
+            'critical': critical,
+            'event_in_progress': active_event >= 0,
+            'pre_heat': pre_heat,
+            'upcoming_event': np.searchsorted(self.event_starts, timestamps, side='right') < self.event_starts.size,
+            'morning_event_today': morning_event[day],
+            'evening_event_today': evening_event[day],
+            'morning_event_tomorrow': morning_event[day + 1],
+            'evening_event_tomorrow': evening_event[day + 1],
+        }
@@ -1,13 +1,19 @@
 """Winter credit processing"""
 import datetime
 import logging
+import threading
 import time
 
-from dateutil import parser
-
+from config.config import get_config
+from hydro_api.auth import LoginError
+from hydro_api.metrics import metrics
 from hydro_api.services import Services
-from .event import Event
+from hydro_api.transport import TransportError
+from . import snapshot as snapshot_file
+from .event import Event, EventTable
+from .index import IntervalIndex
 from .period import Period
+from .snapshot import Snapshot
 
 log = logging.getLogger(__name__)
 
@@ -17,44 +23,266 @@ class WinterCredit:
 
     This class supplements Hydro API data by providing calculated values for pre_heat period, anchor period detection
     as well as next event information.
+
+    The methods can be called from several threads. The data of each refresh is published as an immutable
+    :class:`winter_credit.snapshot.Snapshot`, concurrent refreshes are collapsed into a single request.
+
+    When periods.snapshot_file is set, the events are saved to that file after each refresh. The next
+    WinterCredit starts from the saved events without waiting for hydro and refreshes them in the background,
+    the state is available right away even if hydro cannot be reached.
+
+    The snapshot file is only used for the account of the config credentials.
+
+    :param: background_refresh: return stale data while refreshing it in a background thread instead of
+        waiting for hydro, defaults to the periods.background_refresh config parameter
+    :param: user: hydro account, defaults to the config credentials
+    :param: password: hydro account password, defaults to the config credentials
     """
 
-    def __init__(self):
-        self.api = Services()
-        self.config = self.api.auth.config
-        self.events = {}
-        self.event_in_progress = False
-        self.last_update = 0
-        self._refreshData()
+    def __init__(self, background_refresh=None, user=None, password=None):
+        self.config = get_config()
+        if background_refresh is None:
+            background_refresh = self.config.periods.background_refresh
+        self.background_refresh = background_refresh
+        self.api = Services(user=user, password=password)
+        self.snapshot_file = ''
+        if not user or user == self.config.credentials.user:
+            self.snapshot_file = self.config.periods.snapshot_file
+        self.snapshot = None
+        self.today_periods = None
+        # Serializes the refreshes, callers waiting on it reuse the data fetched by the refresh in flight
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.refresh_thread_lock = threading.Lock()
+        # Failed refreshes in a row and time of the last one, the next attempts are delayed
+        self.refresh_failures = 0
+        self.refresh_failed_at = 0
+        if self.snapshot_file:
+            self.snapshot = self._loadSnapshot(self.snapshot_file)
+        if self.snapshot is None:
+            self._refreshData()
+        elif time.time() > self.nextRefresh():
+            self._startBackgroundRefresh()
+
+    @property
+    def data(self):
+        return self.snapshot.data
+
+    @property
+    def events(self):
+        return self.snapshot.events
+
+    @property
+    def event_index(self):
+        return self.snapshot.event_index
+
+    @property
+    def event_in_progress(self):
+        return self.snapshot.event_in_progress
+
+    @property
+    def last_update(self):
+        return self.snapshot.last_update if self.snapshot is not None else 0
+
+    @property
+    def contract_id(self):
+        """Contract of the data, known without login when starting from a snapshot file"""
+        auth = self.api.auth
+        if auth is not None and auth.contract_id:
+            return auth.contract_id
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.contract_id:
+            return snapshot.contract_id
+        return self.api.contract_id
+
+    def _getDates(self):
+        """Return the current date values used to calculate the state
+
+        :rtype: dict
+        """
+        today = datetime.datetime.now()
+        today_date = today.strftime("%Y-%m-%d")
+        tomorrow = today + datetime.timedelta(days=1)
+        tomorrow_date = tomorrow.strftime("%Y-%m-%d")
+        return {
+            'today': today,
+            'today_date': today_date,
+            'today_noon_ts': self._timestampFromString(today_date + " 12:00:00"),
+            'tomorrow': tomorrow,
+            'tomorrow_date': tomorrow_date,
+            'tomorrow_noon_ts': self._timestampFromString(tomorrow_date + " 12:00:00"),
+        }
+
+    def nextRefresh(self):
+        """Return the time the data is due for a refresh
+
+        The data is refreshed event_refresh_seconds after the last update. After a failed refresh, the next
+        attempt waits periods.refresh_retry_seconds, doubled after each failure up to event_refresh_seconds.
+
+        :rtype: float
+        """
+        refresh_seconds = self.config.periods.event_refresh_seconds
+        next_refresh = self.last_update + refresh_seconds
+        if self.refresh_failures:
+            delay = min(self.config.periods.refresh_retry_seconds * 2 ** (self.refresh_failures - 1),
+                        refresh_seconds)
+            next_refresh = max(next_refresh, self.refresh_failed_at + delay)
+        return next_refresh
 
     def _refreshData(self):
-        """Refresh data if data is older than the config event_refresh_seconds parameter"""
-        # DATES
-        self.ref_date = datetime.datetime.now()
-        # To test the date can be modified artificially here.
-        # self.ref_date = self._dateTimeFromString("2022-01-18 00:00:00")
-        self.today = datetime.datetime.now()
-        self.today_date = self.today.strftime("%Y-%m-%d")
-        self.today_noon_ts = self._timestampFromString(self.today_date + " 12:00:00")
-
-        self.tomorrow = self.today + datetime.timedelta(days=1)
-        self.tomorrow_date = self.tomorrow.strftime("%Y-%m-%d")
-        self.tomorrow_noon_ts = self._timestampFromString(self.tomorrow_date + " 12:00:00")
+        """Refresh data if data is older than the config event_refresh_seconds parameter
+
+        In background refresh mode, stale data is returned right away while a background thread fetches
+        the new data. The caller only waits when there is no data at all yet.
+        The current data is also kept when hydro cannot be reached or rejects the login, the refresh is
+        tried again later, see :meth:`nextRefresh`.
+
+        :return: the current snapshot
 
+        :rtype: Snapshot
+        """
+        snapshot = self.snapshot
         log.debug("Cheking if we need to update the Data")
-        if time.time() > (self.last_update + self.config.periods.event_refresh_seconds):
-            log.debug("Refreshing data")
-            self.data = self.api.getWinterCredit()
-            events_data = self._getWinterCreditEvents()
-            self.events = events_data['events']
-            self.event_in_progress = events_data['event_in_progress']
-            self.last_update = time.time()
+        metrics.increment('winter_credit_refresh_checks_total')
+        if snapshot is None or time.time() > self.nextRefresh():
+            if snapshot is not None and (self.background_refresh or self._isRefreshing()):
+                self._startBackgroundRefresh()
+            else:
+                try:
+                    self._refreshSnapshot()
+                except (TransportError, LoginError) as e:
+                    if snapshot is None:
+                        raise
+                    log.warning("%s, using the data of %s" % (e, datetime.datetime.fromtimestamp(
+                        snapshot.last_update).strftime(self.config.formats.datetime_format)))
         else:
             log.debug("Data is up to date")
+        return self.snapshot
+
+    def _refreshSnapshot(self):
+        """Fetch the data and publish a new snapshot
+
+        Only one refresh runs at a time. Callers that were waiting for it do not fetch the data again.
+        """
+        requested = time.time()
+        with self.refresh_lock:
+            snapshot = self.snapshot
+            if snapshot is not None and snapshot.last_update >= requested:
+                log.debug("Data refreshed while waiting")
+                return
+            if snapshot is not None and self.refresh_failed_at >= requested:
+                log.debug("Refresh failed while waiting, keeping the previous data")
+                return
+            log.debug("Refreshing data")
+            try:
+                with metrics.timer('winter_credit_refresh_duration_seconds'):
+                    data = self.api.getWinterCredit()
+                    events_data = self._getWinterCreditEvents(data, datetime.datetime.now())
+                    snapshot = self._buildSnapshot(data, events_data, time.time(), self.api.contract_id)
+            except Exception:
+                self.refresh_failures += 1
+                self.refresh_failed_at = time.time()
+                metrics.increment('winter_credit_refreshes_total', result='error')
+                raise
+            self.refresh_failures = 0
+            self.snapshot = snapshot
+            metrics.increment('winter_credit_refreshes_total', result='success')
+            if self.snapshot_file:
+                snapshot.save(self.snapshot_file, user=self.config.credentials.user)
+
+    def _buildSnapshot(self, data, events_data, last_update, contract_id):
+        events = events_data['events']
+        event_index = IntervalIndex.fromObjects(
+            list(events['current_winter']['future'].values())
+            + list(events['current_winter']['past'].values())
+        )
+        return Snapshot(data, events, event_index, events_data['event_in_progress'], last_update, contract_id)
+
+    def _loadSnapshot(self, path):
+        """Build a snapshot from the events saved in a file, None if there is no usable file
 
-    def _getWinterCreditEvents(self):
+        Events are sorted again between past and future as time went by since they were saved.
+        A file saved for another account than the config credentials is not used.
+
+        :rtype: Snapshot
+        """
+        saved = snapshot_file.load(path)
+        if saved is None:
+            return None
+        if saved.get('user') != self.config.credentials.user:
+            # The contract_id of the file would be served for the account of the credentials
+            log.warning('ignoring snapshot %s saved for another account' % path)
+            return None
+        ref_date = datetime.datetime.now()
+        events = {
+            'current_winter': {
+                'past': {},
+                'future': {}
+            },
+            'past_winters': {},
+            'next': {}
+        }
+        for group in ('current_winter', 'past_winters'):
+            for day, start_ts, end_ts in saved[group]:
+                event = Event(
+                    config=self.config,
+                    date=datetime.date.fromordinal(day),
+                    start=datetime.datetime.fromtimestamp(start_ts),
+                    end=datetime.datetime.fromtimestamp(end_ts)
+                )
+                if group == 'past_winters':
+                    events['past_winters'][event.end_ts] = event
+                elif event.end_ts >= ref_date.timestamp():
+                    events['current_winter']['future'][event.end_ts] = event
+                else:
+                    events['current_winter']['past'][event.end_ts] = event
+        next_event = self._getNextEvent(events, ref_date)
+        events['next'] = next_event['next']
+        log.info("Starting from the data of %s saved in %s" % (datetime.datetime.fromtimestamp(
+            saved['last_update']).strftime(self.config.formats.datetime_format), path))
+        return self._buildSnapshot(None, {'events': events, 'event_in_progress': next_event['event_in_progress']},
+                                   saved['last_update'], saved.get('contract_id'))
+
+    def _isRefreshing(self):
+        refresh_thread = self.refresh_thread
+        return refresh_thread is not None and refresh_thread.is_alive()
+
+    def waitRefresh(self, timeout=None):
+        """Wait for the background refresh in progress, if any
+
+        :param: timeout: maximum seconds to wait
+
+        :return: False if the refresh is still running after timeout
+
+        :rtype: bool
+        """
+        refresh_thread = self.refresh_thread
+        if refresh_thread is not None:
+            refresh_thread.join(timeout)
+        return not self._isRefreshing()
+
+    def _startBackgroundRefresh(self):
+        """Start a background refresh unless one is already running"""
+        with self.refresh_thread_lock:
+            if self._isRefreshing():
+                return
+            self.refresh_thread = threading.Thread(target=self._backgroundRefresh, daemon=True)
+            self.refresh_thread.start()
+
+    def _backgroundRefresh(self):
+        try:
+            self._refreshSnapshot()
+        except (TransportError, LoginError) as e:
+            log.warning("%s, keeping the previous data" % e)
+        except Exception:
+            log.exception("Unable to refresh data, keeping the previous data")
+
+    def _getWinterCreditEvents(self, data, ref_date):
         """Return winter peak events in a more structured way
 
+        :param: data: getWinterCredit() response
+        :param: ref_date: datetime separating past and future events
+
         :return:
 
         JSON Object with current_winter, past_winters and next event.
@@ -82,6 +310,7 @@ class WinterCredit:
         - The timestamp is the timestamp of the end of the event
         - Future events have a 'pre_heat' datetime as a helper for homeassistant pre-event automations (offset -3h)
         """
+        from dateutil import parser
         events = {
             'current_winter': {
                 'past': {},
@@ -90,8 +319,8 @@ class WinterCredit:
             'past_winters': {},
             'next': {}
         }
-        if 'periodesEffacementsHivers' in self.data:
-            for season in self.data['periodesEffacementsHivers']:
+        if 'periodesEffacementsHivers' in data:
+            for season in data['periodesEffacementsHivers']:
                 winter_start = parser.isoparse(season['dateDebutPeriodeHiver']).date()
                 winter_end = parser.isoparse(season['dateFinPeriodeHiver']).date()
                 if winter_start <= datetime.date.today() <= winter_end:
@@ -110,7 +339,7 @@ class WinterCredit:
                         )
 
                         future = False
-                        if event.end_ts >= self.ref_date.timestamp():
+                        if event.end_ts >= ref_date.timestamp():
                             future = True
                         if current:
                             if future:
@@ -118,9 +347,9 @@ class WinterCredit:
                             else:
                                 events['current_winter']['past'][event.end_ts] = event
                         else:
-                            events['past_winter'][event.end_ts] = event
+                            events['past_winters'][event.end_ts] = event
 
-        next_event = self._getNextEvent(events)
+        next_event = self._getNextEvent(events, ref_date)
         events['next'] = next_event['next']
 
         return {'events': events, 'event_in_progress': next_event['event_in_progress']}
@@ -132,10 +361,10 @@ class WinterCredit:
 
         :rtype: list
         """
-        self._refreshData()
+        future = self._refreshData().events['current_winter']['future']
         future_events = []
-        for future_ts in self.events['current_winter']['future']:
-            future_events.append(self.events['current_winter']['future'][future_ts].to_dict())
+        for future_ts in future:
+            future_events.append(future[future_ts].to_dict())
 
         return future_events
 
@@ -146,14 +375,38 @@ class WinterCredit:
 
         :rtype: list
         """
-        self._refreshData()
+        current_winter = self._refreshData().events['current_winter']
         events = []
-        for future_ts in self.events['current_winter']['future']:
-            events.append(self.events['current_winter']['future'][future_ts])
-        for past_ts in self.events['current_winter']['past']:
-            events.append(self.events['current_winter']['past'][past_ts])
+        for future_ts in current_winter['future']:
+            events.append(current_winter['future'][future_ts])
+        for past_ts in current_winter['past']:
+            events.append(current_winter['past'][past_ts])
         return events
 
+    def getPastWintersEvents(self):
+        """Return the events of the previous winters
+
+        :return: events list
+
+        :rtype: list
+        """
+        return list(self._refreshData().events['past_winters'].values())
+
+    def getCreditEstimate(self, records):
+        """Estimate the credit earned by the events of the current and past winters
+
+        :param: records: hourly consumption records covering the events, see :mod:`hydro_api.consumption`,
+            or a :class:`hydro_api.series.ConsumptionSeries`
+
+        :return: see :meth:`winter_credit.estimator.CreditEstimator.estimate`
+
+        :rtype: dict
+        """
+        # numpy is only imported when an estimate is requested
+        from .estimator import CreditEstimator
+        events = self.getAllEvents() + self.getPastWintersEvents()
+        return CreditEstimator.fromEvents(self.config, events, records).estimate()
+
     def getNextEvent(self):
         """Return next event object
 
@@ -161,8 +414,7 @@ class WinterCredit:
 
         :rtype: dict
         """
-        self._refreshData()
-        return self.events['next']
+        return self._refreshData().events['next']
 
     def _dateTimeFromString(self, date_string):
         return datetime.datetime.strptime(date_string, "%Y-%m-%d %H:%M:%S")
@@ -170,14 +422,14 @@ class WinterCredit:
     def _timestampFromString(self, date_string):
         return self._dateTimeFromString(date_string).timestamp()
 
-    def _getTodayPeakPeriods(self):
+    def _getTodayPeakPeriods(self, today_date):
         # PEAK PERIODS
         today_peak_morning_start = self._dateTimeFromString(
-            self.today_date + " " + self.config.periods.morning_peak_start)
-        today_peak_morning_end = self._dateTimeFromString(self.today_date + " " + self.config.periods.morning_peak_end)
+            today_date + " " + self.config.periods.morning_peak_start)
+        today_peak_morning_end = self._dateTimeFromString(today_date + " " + self.config.periods.morning_peak_end)
         today_peak_evening_start = self._dateTimeFromString(
-            self.today_date + " " + self.config.periods.evening_peak_start)
-        today_peak_evening_end = self._dateTimeFromString(self.today_date + " " + self.config.periods.evening_peak_end)
+            today_date + " " + self.config.periods.evening_peak_start)
+        today_peak_evening_end = self._dateTimeFromString(today_date + " " + self.config.periods.evening_peak_end)
 
         morning = Period(
             config=self.config,
@@ -218,44 +470,65 @@ class WinterCredit:
 
         return {'morning': morning, 'evening': evening}
 
+    def _getTodayPeriods(self, today_date):
+        """Return today's peak and anchor periods and their index, they are calculated once per day
+
+        :param: today_date: YYYY-MM-DD string
+
+        :rtype: dict
+        """
+        today_periods = self.today_periods
+        if today_periods is None or today_periods['date'] != today_date:
+            peak_periods = self._getTodayPeakPeriods(today_date)
+            anchor_start_offset = datetime.timedelta(hours=self.config.periods.anchor_start_offset)
+            anchor_duration = datetime.timedelta(hours=self.config.periods.anchor_duration)
+            anchor_periods = self._getTodayAnchorPeriods(peak_periods, anchor_start_offset, anchor_duration)
+            index = IntervalIndex([
+                (peak_periods['morning'].start_ts, peak_periods['morning'].end_ts, ('peak', 'peak_morning')),
+                (peak_periods['evening'].start_ts, peak_periods['evening'].end_ts, ('peak', 'peak_evening')),
+                (anchor_periods['morning'].start_ts, anchor_periods['morning'].end_ts, ('anchor', 'anchor_morning')),
+                (anchor_periods['evening'].start_ts, anchor_periods['evening'].end_ts, ('anchor', 'anchor_evening')),
+            ])
+            today_periods = {
+                'date': today_date,
+                'peak': peak_periods,
+                'anchor': anchor_periods,
+                'index': index
+            }
+            self.today_periods = today_periods
+        return today_periods
+
     def getCurrentState(self):
         """Calculate current periods"""
-        self._refreshData()
-
-        peak_periods = self._getTodayPeakPeriods()
-        morning_peak_period = peak_periods['morning']
-        evening_peak_period = peak_periods['evening']
+        started = time.perf_counter()
+        snapshot = self._refreshData()
+        dates = self._getDates()
+        now = dates['today'].timestamp()
+
+        today_periods = self._getTodayPeriods(dates['today_date'])
+        morning_peak_period = today_periods['peak']['morning']
+        evening_peak_period = today_periods['peak']['evening']
         anchor_start_offset = datetime.timedelta(hours=self.config.periods.anchor_start_offset)
         anchor_duration = datetime.timedelta(hours=self.config.periods.anchor_duration)
-        anchor_periods = self._getTodayAnchorPeriods(peak_periods, anchor_start_offset, anchor_duration)
-        morning_anchor_period = anchor_periods['morning']
-        evening_anchor_period = anchor_periods['evening']
+        morning_anchor_period = today_periods['anchor']['morning']
+        evening_anchor_period = today_periods['anchor']['evening']
 
         '''
         Calculation for the next periods.
         '''
-        if self.today.timestamp() <= morning_peak_period.end_ts:
+        if now <= morning_peak_period.end_ts:
             next_peak_period_start = morning_peak_period.start_dt
             next_peak_period_end = morning_peak_period.end_dt
-        elif morning_peak_period.end_ts <= self.today.timestamp() <= evening_peak_period.end_ts:
+        elif morning_peak_period.end_ts <= now <= evening_peak_period.end_ts:
             next_peak_period_start = evening_peak_period.start_dt
             next_peak_period_end = evening_peak_period.end_dt
         else:
             next_peak_period_start = morning_peak_period.start_dt + datetime.timedelta(days=1)
             next_peak_period_end = morning_peak_period.end_dt + datetime.timedelta(days=1)
 
-        if morning_peak_period.start_ts <= self.today.timestamp() <= morning_peak_period.end_ts:
-            current_period = 'peak'
-            current_period_time_of_day = 'peak_morning'
-        elif evening_peak_period.start_ts <= self.today.timestamp() <= evening_peak_period.end_ts:
-            current_period = 'peak'
-            current_period_time_of_day = 'peak_evening'
-        elif morning_anchor_period.start_ts <= self.today.timestamp() <= morning_anchor_period.end_ts:
-            current_period = 'anchor'
-            current_period_time_of_day = 'anchor_morning'
-        elif evening_anchor_period.start_ts <= self.today.timestamp() <= evening_anchor_period.end_ts:
-            current_period = 'anchor'
-            current_period_time_of_day = 'anchor_evening'
+        current = today_periods['index'].activeAt(now)
+        if current:
+            current_period, current_period_time_of_day = current
         else:
             current_period = 'normal'
             current_period_time_of_day = 'normal'
@@ -265,29 +538,24 @@ class WinterCredit:
         evening_event_today = False
         morning_event_tomorrow = False
         evening_event_tomorrow = False
-        upcoming_event = False
-        next_peak_critical = False
-        next_event = self.getNextEvent()
+        next_event = snapshot.events['next']
 
         if isinstance(next_event,Event) and next_event.pre_heat_start_ts:
-            if next_event.pre_heat_start_ts <= self.today.timestamp() <= next_event.pre_heat_end_ts:
+            if next_event.pre_heat_start_ts <= now <= next_event.pre_heat_end_ts:
                 pre_heat = True
-        for event in self.getAllEvents():
-            if event.date:
-                if event.date == self.today_date:
-                    if event.start_ts < self.today_noon_ts:
-                        morning_event_today = True
-                    else:
-                        evening_event_today = True
-                    if event.end_ts == next_peak_period_end.timestamp():
-                        next_peak_critical = True
-                elif event.date == self.tomorrow_date:
-                    if event.start_ts < self.tomorrow_noon_ts:
-                        morning_event_tomorrow = True
-                    else:
-                        evening_event_tomorrow = True
-                if event.start_ts > self.today.timestamp():
-                    upcoming_event = True
+        for event in snapshot.event_index.onDate(dates['today_date']):
+            if event.start_ts < dates['today_noon_ts']:
+                morning_event_today = True
+            else:
+                evening_event_today = True
+        for event in snapshot.event_index.onDate(dates['tomorrow_date']):
+            if event.start_ts < dates['tomorrow_noon_ts']:
+                morning_event_tomorrow = True
+            else:
+                evening_event_tomorrow = True
+        upcoming_event = snapshot.event_index.nextAfter(now) is not None
+        next_peak_critical = snapshot.event_index.activeAt(next_peak_period_end.timestamp()) is not None
+        event_in_progress = snapshot.event_index.activeAt(now) is not None
 
         if next_peak_critical:
             current_composite_state = current_period_time_of_day + '_critical'
@@ -316,7 +584,7 @@ class WinterCredit:
                 'current_period_time_of_day': current_period_time_of_day,
                 'current_composite_state': current_composite_state,
                 'critical': next_peak_critical,
-                'event_in_progress': self.event_in_progress,
+                'event_in_progress': event_in_progress,
                 'pre_heat': pre_heat,
                 'upcoming_event': upcoming_event,
                 'morning_event_today': morning_event_today,
@@ -337,13 +605,77 @@ class WinterCredit:
                 'evening': evening_peak_period.to_dict()
 
             },
-            'last_update': self.today.strftime(self.config.formats.datetime_format)
+            'last_update': dates['today'].strftime(self.config.formats.datetime_format)
         }
+        metrics.observe('winter_credit_state_duration_seconds', time.perf_counter() - started)
         return response
 
     def _getCurrentState(self):
         return {}
 
+    def _getTimeline(self, snapshot):
+        if snapshot.timeline is None:
+            from .timeline import StateTimeline
+            events = EventTable.fromEvents(
+                self.config, list(snapshot.event_index.items) + list(snapshot.events['past_winters'].values()))
+            snapshot.timeline = StateTimeline(self.config, events.starts, events.ends)
+        return snapshot.timeline
+
+    def getStateTimeline(self, timestamps):
+        """Calculate the state at many timestamps at once
+
+        Current and past winters events are taken into account. Useful to simulate a whole winter,
+        ex: one timestamp per minute.
+
+        :param: timestamps: unix timestamps
+
+        :return: numpy arrays indexed like timestamps, same keys as getCurrentState()['state']
+
+        :rtype: dict
+        """
+        return self._getTimeline(self._refreshData()).evaluate(timestamps)
+
+    def getStateAt(self, ts):
+        """Calculate the state at any point in time
+
+        :param: ts: unix timestamp or datetime
+
+        :return: same values as getCurrentState()['state']
+
+        :rtype: dict
+        """
+        if isinstance(ts, datetime.datetime):
+            ts = ts.timestamp()
+        timeline = self.getStateTimeline([ts])
+        return {key: values[0].item() for key, values in timeline.items()}
+
+    def getNextTransition(self):
+        """Return the time of the next boundary that can change the current state
+
+        Boundaries are the start and end of today's peak and anchor periods, the start, end and pre-heat
+        of the events and midnight (today's periods and events are recalculated for the next day).
+
+        :return: unix timestamp
+
+        :rtype: float
+        """
+        dates = self._getDates()
+        now = dates['today'].timestamp()
+        peak_periods = self._getTodayPeakPeriods(dates['today_date'])
+        anchor_start_offset = datetime.timedelta(hours=self.config.periods.anchor_start_offset)
+        anchor_duration = datetime.timedelta(hours=self.config.periods.anchor_duration)
+        anchor_periods = self._getTodayAnchorPeriods(peak_periods, anchor_start_offset, anchor_duration)
+
+        midnight = datetime.datetime.combine(dates['tomorrow'].date(), datetime.time())
+        boundaries = [midnight.timestamp()]
+        for period in list(peak_periods.values()) + list(anchor_periods.values()):
+            boundaries += [period.start_ts, period.end_ts]
+        for event in self.getAllEvents():
+            boundaries += [event.start_ts, event.end_ts]
+            if event.pre_heat_start_ts:
+                boundaries += [event.pre_heat_start_ts, event.pre_heat_end_ts]
+        return min(boundary for boundary in boundaries if boundary > now)
+
     def _getPreHeat(self, start):
         """Calculate pre_heat period according to event start date
 
@@ -353,7 +685,6 @@ class WinterCredit:
 
         :rtype: dict
         """
-        print(start)
         pre_heat_start_offset = datetime.timedelta(hours=self.config.periods.pre_heat_start_offset)
         pre_heat_start = start - pre_heat_start_offset
         pre_heat_end_offset = datetime.timedelta(hours=self.config.periods.pre_heat_end_offset)
@@ -366,34 +697,26 @@ class WinterCredit:
         }
         return pre_heat
 
-    def _getNextEvent(self, events):
+    def _getNextEvent(self, events, ref_date):
         """Calculate the next events
 
-        :param: events: the events object we have built from hydro API self.data
+        :param: events: the events object we have built from hydro API data
+        :param: ref_date: datetime used to find the event in progress
 
         :return: event object
 
         :rtype: dict
         """
 
-        event_in_progress = False
-        next_event_timestamp = None
-        next_event = {}
-        if events['current_winter']['future']:
-            for timestamp in events['current_winter']['future']:
-                event = events['current_winter']['future'][timestamp]
-                pre_heat = self._getPreHeat(event.start_dt)
-                event.addPreheat(pre_heat['pre_heat_start'], pre_heat['pre_heat_end'],
-                                 pre_heat['pre_heat_start_ts'], pre_heat['pre_heat_end_ts'])
-
-                if event.start_ts <= self.ref_date.timestamp() <= event.end_ts:
-                    event_in_progress = True
-                    next_event_timestamp = timestamp
-                    break
-
-            if not event_in_progress:
-                next_event_timestamp = min(events['current_winter']['future'], key=float)
-        if next_event_timestamp:
-            next_event = events['current_winter']['future'][next_event_timestamp]
+        future_events = sorted(events['current_winter']['future'].values(), key=lambda event: event.start_ts)
+        for event in future_events:
+            pre_heat = self._getPreHeat(event.start_dt)
+            event.addPreheat(pre_heat['pre_heat_start_ts'], pre_heat['pre_heat_end_ts'])
+
+        next_event = IntervalIndex.fromObjects(future_events).activeAt(ref_date.timestamp())
+        event_in_progress = next_event is not None
+        if not event_in_progress:
+            # Future events all end after the reference date, the first one is the next event
+            next_event = future_events[0] if future_events else {}
 
         return {'next': next_event, 'event_in_progress': event_in_progress}